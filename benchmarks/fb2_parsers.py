@@ -0,0 +1,65 @@
+"""
+Compares paragraph parser backends selectable by Library.xml_parser on books of a real library.
+Every book is decompressed and decoded once, backends parse the same text from memory,
+so only parsing is timed. Backends that are not installed are skipped.
+
+Usage: python -m benchmarks.fb2_parsers <library_root> [--books N]
+"""
+import io
+import os
+import time
+import argparse
+
+from utils import library, zip_index
+
+
+def main(library_root: str, books: int) -> None:
+    parsers = {
+        name: parse for name, parse in library.PARAGRAPH_PARSERS.items()
+        if name != 'lxml' or library.lxml_etree is not None
+    }
+    totals = {name: 0. for name in parsers}
+    checked = 0
+
+    for archive_name in sorted(os.listdir(library_root)):
+        if not archive_name.endswith('.zip'):
+            continue
+        zip_file_path = os.path.join(library_root, archive_name)
+        for fb2_file_name in zip_index.get_member_names(zip_file_path):
+            if checked >= books:
+                break
+            if not fb2_file_name.endswith('.fb2'):
+                continue
+            _, encoding = library.parse_fb2_from_zip(
+                zip_file_path, fb2_file_name, library.read_fb2_paragraphs_etree, list
+            )
+            if encoding is None:
+                continue
+            with zip_index.open_member(zip_file_path, zip_index.get_member(zip_file_path, fb2_file_name)) as source:
+                text = source.read().decode(encoding)
+
+            results = {}
+            times = {}
+            for name, parse in parsers.items():
+                start = time.perf_counter()
+                results[name] = parse(io.StringIO(text))
+                times[name] = time.perf_counter() - start
+                totals[name] += times[name]
+
+            if any(paragraphs != results['etree'] for paragraphs in results.values()):
+                raise AssertionError(f"Different paragraphs for {archive_name}/{fb2_file_name}.")
+
+            checked += 1
+            print(f"{archive_name}/{fb2_file_name}: {len(results['etree'])} paragraphs, "
+                  + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in times.items()))
+
+    print(f"{checked} books with identical output. "
+          + ", ".join(f"{name} {seconds:.3f} s" for name, seconds in totals.items()) + " in total.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('library_root')
+    parser.add_argument('--books', type=int, default=100, help="Number of books to compare")
+    args = parser.parse_args()
+    main(args.library_root, args.books)
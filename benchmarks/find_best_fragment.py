@@ -0,0 +1,136 @@
+"""
+Compares preprocess_paragraphs and find_best_fragment with the original implementation, which used
+a regex per word, per-paragraph dicts and summed paragraph lengths of every window from scratch,
+on books of a real library.
+
+Usage: python -m benchmarks.find_best_fragment <library_root> <word> [<word> ...] [--books N]
+"""
+import os
+import re
+import time
+import argparse
+
+from utils import library, zip_index
+
+
+def legacy_preprocess_paragraphs(paragraphs, words):
+    """preprocess_paragraphs with a regex per word and a dict per paragraph."""
+    word_patterns = {
+        word: re.compile(rf'(?<![а-яёa-z]){word}(?![а-яёa-z])', re.IGNORECASE | re.MULTILINE)
+        for word in words
+    }
+    return [
+        {
+            "text": paragraph,
+            "length": len(paragraph),
+            "counts": {word: len(re.findall(pattern, paragraph)) for word, pattern in word_patterns.items()}
+        }
+        for paragraph in paragraphs
+    ]
+
+
+def legacy_find_best_fragment(preprocessed, words, min_length=512, max_length=2096):
+    """find_best_fragment over per-paragraph dicts, summing the length of every window."""
+    found_words = set()
+    for para in preprocessed:
+        for word, count in para["counts"].items():
+            if count > 0:
+                found_words.add(word)
+        if len(found_words) == len(words):
+            break
+    else:
+        return "", {word: 0 for word in words}
+
+    word_positions = {word: [] for word in words}
+    for i, para in enumerate(preprocessed):
+        for word in words:
+            if para["counts"][word] > 0:
+                word_positions[word].append(i)
+
+    all_positions = []
+    for word, positions in word_positions.items():
+        all_positions.extend((pos, word) for pos in positions)
+    all_positions.sort(key=lambda x: x[0])
+
+    if not all_positions:
+        return "", {word: 0 for word in words}
+
+    best_fragment = []
+    best_score = -1
+    best_fragment_count = {word: 0 for word in words}
+
+    left = 0
+    current_counts = {word: 0 for word in words}
+
+    for right in range(len(all_positions)):
+        pos, word = all_positions[right]
+        current_counts[word] += preprocessed[pos]["counts"][word]
+
+        while left < right:
+            left_pos, left_word = all_positions[left]
+            if current_counts[left_word] - preprocessed[left_pos]["counts"][left_word] > 0:
+                current_counts[left_word] -= preprocessed[left_pos]["counts"][left_word]
+                left += 1
+            else:
+                break
+
+        if all(count > 0 for count in current_counts.values()):
+            start_pos = all_positions[left][0]
+            end_pos = pos
+            length = sum(para["length"] for para in preprocessed[start_pos:end_pos + 1])
+
+            if min_length <= length <= max_length:
+                score = min(current_counts.values())
+                if score > best_score:
+                    best_score = score
+                    best_fragment = preprocessed[start_pos:end_pos + 1]
+                    best_fragment_count = current_counts.copy()
+
+    if not best_fragment:
+        return "", {word: 0 for word in words}
+
+    return "\n\n".join(p["text"] for p in best_fragment), best_fragment_count
+
+
+def main(library_root: str, words: list[str], books: int) -> None:
+    legacy_total = current_total = 0.
+    checked = 0
+
+    for archive_name in sorted(os.listdir(library_root)):
+        if not archive_name.endswith('.zip'):
+            continue
+        zip_file_path = os.path.join(library_root, archive_name)
+        for fb2_file_name in zip_index.get_member_names(zip_file_path):
+            if checked >= books:
+                break
+            paragraphs = library.extract_paragraphs_from_zip(zip_file_path, fb2_file_name)
+            if not paragraphs:
+                continue
+            start = time.perf_counter()
+            legacy = legacy_find_best_fragment(legacy_preprocess_paragraphs(paragraphs, words), words)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            current = library.find_best_fragment(library.preprocess_paragraphs(paragraphs, words), words)
+            current_time = time.perf_counter() - start
+
+            if legacy != current:
+                raise AssertionError(f"Different fragments for {archive_name}/{fb2_file_name}.")
+
+            legacy_total += legacy_time
+            current_total += current_time
+            checked += 1
+            print(f"{archive_name}/{fb2_file_name}: {len(paragraphs)} paragraphs, "
+                  f"legacy {legacy_time * 1000:.1f} ms, current {current_time * 1000:.1f} ms")
+
+    print(f"{checked} books with identical output. "
+          f"Legacy {legacy_total:.3f} s, current {current_total:.3f} s in total.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('library_root')
+    parser.add_argument('words', nargs='+')
+    parser.add_argument('--books', type=int, default=100, help="Number of books to compare")
+    args = parser.parse_args()
+    main(args.library_root, args.words, args.books)
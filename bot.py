@@ -2,17 +2,12 @@ import asyncio
 import logging
 import os
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-
 import aioschedule
-from utils import library
 from utils import database
+from utils import full_search
+from utils import result_cache
+from utils.search_pool import start_search_pool, shutdown_search_pool
 from utils.config_parser import *
-from handlers.fragment import fragment_router
-from handlers.start import start_router
-from handlers.profile import profile_router
 
 CONFIG_FILE = "config.ini"
 
@@ -31,8 +26,19 @@ async def scheduler():
 
 
 async def main(token: str) -> None:
+    # Search workers import this module as their main module, so aiogram, the handlers and
+    # the word2vec model they load are only imported here, in the bot process
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+    from handlers.fragment import fragment_router
+    from handlers.start import start_router
+    from handlers.profile import profile_router
+
     await database.init_pool()
+    start_search_pool()
     aioschedule.every().day.at("00:00").do(database.refund_all_free_tokens)
+    aioschedule.every().day.at("03:00").do(full_search.clean_negative_cache)
     asyncio.create_task(scheduler())
     dp = Dispatcher()
     dp.include_routers(
@@ -41,10 +47,13 @@ async def main(token: str) -> None:
         profile_router
     )
     bot = Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        shutdown_search_pool()
+        result_cache.flush()
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    library.remove_cache()
     asyncio.run(main(config['Bot']['bot_token']))
@@ -1,21 +1,25 @@
-import random
 import re
+import time
+from typing import Literal
+from dataclasses import dataclass
 
 from aiogram import Router, F
 from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, ReplyKeyboardRemove, InlineKeyboardButton, ReplyKeyboardMarkup, CallbackQuery,\
-    LinkPreviewOptions
+    LinkPreviewOptions, User
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from utils import library
+from utils import library, prefetch, result_cache
 from utils.l18n import l18n
+from utils.config_parser import read_config
 from utils.keyboards import get_menu_keyboard, CANCEL_BUTTON
 from utils.translate import translate_words_in_text
+from utils.full_search import full_search, iter_candidate_book_ids
 from utils.database import search_books, search_authors, get_book_by_id, add_fragment_record, get_user_data, \
     user_decrease_free_tokens, user_decrease_paid_tokens, user_increase_paid_tokens_spent, BookSearchResult, \
-    get_book_ids_by_words_frequency, add_transaction_record
+    add_transaction_record
 
 
 class FragmentSearchStateGroup(StatesGroup):
@@ -37,8 +41,20 @@ class AuthorCallbackFactory(CallbackData, prefix="author"):
     name: str
 
 
+@dataclass
+class PendingFragments:
+    book: BookSearchResult
+    words: list[str]
+    search_type: Literal['full', 'book']
+    fragments: list[tuple[str, dict[str, int]]]
+    expires_at: float
+
+
 fragment_router = Router()
 
+# Other fragments of the last found book per chat, served by the "another fragment" button
+pending_fragments: dict[int, PendingFragments] = {}
+
 
 @fragment_router.message(F.text.casefold() == l18n.get("ru", "buttons", "start", "fragment_search").casefold())
 async def fragment_handler(message: Message, state: FSMContext) -> None:
@@ -274,6 +290,7 @@ async def process_title(message: Message, state: FSMContext) -> None:
     if len(search) == 1:
         await state.update_data(title=search[0].title)
         await state.update_data(book_id=search[0].id)
+        prefetch.start_prefetch(message.chat.id, search[0])
         await message.answer(
             l18n.get("ru", "messages", "fragment", "book_selected").format(
                 title=search[0].title,
@@ -317,6 +334,7 @@ async def choose_book_callback(callback: CallbackQuery, callback_data: BookCallb
         raise Exception(f"No books found by selected ID {callback_data.id}.")
 
     await state.update_data(book_id=book.id)
+    prefetch.start_prefetch(callback.message.chat.id, book)
     await callback.answer()
     await callback.message.answer(
         l18n.get("ru", "messages", "fragment", "book_selected").format(
@@ -388,6 +406,95 @@ async def process_words(message: Message, state: FSMContext) -> None:
     await search_fragment(message, state)
 
 
+def get_fragment_max_length(book: BookSearchResult, words: list[str]) -> int:
+    header_string = l18n.get("ru", "messages", "fragment", "fragment").format(
+        title=book.title,
+        author=book.author,
+        words_query=', '.join(words),
+        fragment=""
+    )
+    return 3549 - len(header_string)
+
+
+def get_fragments_per_search() -> int:
+    return int(read_config('config.ini').get('Search', {}).get('fragments_per_search', 3))
+
+
+def store_pending_fragments(chat_id: int, book: BookSearchResult, words: list[str],
+                            search_type: Literal['full', 'book'], fragments: list[tuple[str, dict[str, int]]]) -> None:
+    """Keeps other fragments of the found book for the chat for a while, so they are sent without searching again."""
+    now = time.monotonic()
+    for expired_chat_id in [x for x, pending in pending_fragments.items() if pending.expires_at <= now]:
+        del pending_fragments[expired_chat_id]
+
+    if not fragments:
+        pending_fragments.pop(chat_id, None)
+        return
+    ttl = float(read_config('config.ini').get('Search', {}).get('pending_fragments_ttl_seconds', 900))
+    pending_fragments[chat_id] = PendingFragments(book, words, search_type, fragments, now + ttl)
+
+
+async def offer_another_fragment(message: Message) -> None:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(
+        text=l18n.get("ru", "buttons", "another_fragment"),
+        callback_data="another_fragment")
+    )
+    await message.answer(
+        l18n.get("ru", "messages", "fragment", "another_fragment_offer"),
+        reply_markup=builder.as_markup()
+    )
+
+
+async def send_fragment(message: Message, user: User, book: BookSearchResult, words: list[str], fragment: str,
+                        search_type: Literal['full', 'book']) -> bool:
+    """
+    Charges the user for the words and sends the fragment with translated words.
+    Returns False without sending anything if the user does not have enough tokens.
+    """
+    user_data = await get_user_data(user)
+    total_tokens = user_data.free_tokens + user_data.paid_tokens
+    price = len(words)
+    if price > total_tokens:
+        return False
+
+    translated_fragment = await result_cache.get_translation(fragment, words)
+    if translated_fragment is None:
+        translated_fragment = await translate_words_in_text(fragment, words)
+        await result_cache.put_translation(fragment, words, translated_fragment)
+
+    free_tokens_to_pay = min(price, user_data.free_tokens)
+    paid_tokens_to_pay = max(0, price - free_tokens_to_pay)
+
+    if paid_tokens_to_pay:
+        await user_decrease_free_tokens(user, free_tokens_to_pay)
+
+    if paid_tokens_to_pay:
+        await user_decrease_paid_tokens(user, paid_tokens_to_pay)
+        await user_increase_paid_tokens_spent(user, paid_tokens_to_pay)
+
+    transaction_id = await add_transaction_record(
+        user.id,
+        free_tokens_to_pay,
+        paid_tokens_to_pay,
+        'remove'
+    )
+
+    await message.answer(
+        l18n.get("ru", "messages", "fragment", "fragment").format(
+            title=book.title,
+            author=book.author,
+            words_query=', '.join(words),
+            fragment=translated_fragment
+        ),
+        reply_markup=get_menu_keyboard(user.username),
+        link_preview_options=LinkPreviewOptions(is_disabled=True)
+    )
+
+    await add_fragment_record(user.id, book.id, words, fragment, translated_fragment, search_type, transaction_id)
+    return True
+
+
 async def search_fragment(message: Message, state: FSMContext) -> None:
     await state.set_state(FragmentSearchStateGroup.search_fragment)
     await message.answer(
@@ -395,49 +502,22 @@ async def search_fragment(message: Message, state: FSMContext) -> None:
         reply_markup=ReplyKeyboardRemove()
     )
     fragment = ''
+    more_fragments = []
 
     data = await state.get_data()
     if data["full_search"]:
         search_type = "full"
         # fragment, book = await library.process_full_search(data["words"], max_length=3096)
 
-        book_ids = await get_book_ids_by_words_frequency(data["words"], 20)
-        random.shuffle(book_ids)
-
-        found_fragments: list[tuple[str, dict[str, int], BookSearchResult]] = list()
-        best_fragment = ''
-        best_book = None
-        for book_id in book_ids:
-            book = await get_book_by_id(book_id)
-            header_string = l18n.get("ru", "messages", "fragment", "fragment").format(
-                title=book.title,
-                author=book.author,
-                words_query=', '.join(data["words"]),
-                fragment=""
-            )
-            fragment, words_found = await library.process_fragment_search(
-                book.archive,
-                book.filename,
-                data["words"],
-                max_length=3549 - len(header_string),
-                skip_from=150000
-            )
-            if fragment:
-                if sum(words_found.values()) > 5 and all(x > 0 for x in words_found.values()):
-                    best_fragment = fragment
-                    best_book = book
-                    break
-                found_fragments.append((fragment, words_found, book))
-
-        if not best_fragment:
-            m = -1
-            for fragment, words_found, book in found_fragments:
-                if sum(words_found.values()) > m and all(x > 0 for x in words_found.values()):
-                    best_fragment = fragment
-                    best_book = book
-                    m = sum(words_found.values())
-        fragment = best_fragment
-        book = best_book
+        result = await full_search(
+            iter_candidate_book_ids(data["words"]),
+            data["words"],
+            lambda book: get_fragment_max_length(book, data["words"]),
+            count=get_fragments_per_search()
+        )
+        fragment = result.fragment
+        book = result.book
+        more_fragments = result.more_fragments
     else:
         search_type = "book"
         if data["book_id"]:
@@ -456,17 +536,14 @@ async def search_fragment(message: Message, state: FSMContext) -> None:
             )
             return
 
-        header_string = l18n.get("ru", "messages", "fragment", "fragment").format(
-                    title=book.title,
-                    author=book.author,
-                    words_query=', '.join(data["words"]),
-                    fragment=""
-        )
-        fragment, words_found = await library.process_fragment_search(
+        await prefetch.wait_prefetch(message.chat.id)
+        (fragment, words_found), *more_fragments = await library.process_fragments_search(
             book.archive,
             book.filename,
             data["words"],
-            max_length=3549-len(header_string)
+            max_length=get_fragment_max_length(book, data["words"]),
+            count=get_fragments_per_search(),
+            encoding=book.encoding
         )
 
     await state.clear()
@@ -488,41 +565,39 @@ async def search_fragment(message: Message, state: FSMContext) -> None:
                 reply_markup=get_menu_keyboard(message.from_user.username)
             )
     else:
-        translated_fragment = await translate_words_in_text(fragment, data["words"])
-
-        user_data = await get_user_data(message.from_user)
-        total_tokens = user_data.free_tokens + user_data.paid_tokens
-        price = len(data["words"])
-        if price <= total_tokens:
-            free_tokens_to_pay = min(price, user_data.free_tokens)
-            paid_tokens_to_pay = max(0, price - free_tokens_to_pay)
-
-            if paid_tokens_to_pay:
-                await user_decrease_free_tokens(message.from_user, free_tokens_to_pay)
-
-            if paid_tokens_to_pay:
-                await user_decrease_paid_tokens(message.from_user, paid_tokens_to_pay)
-                await user_increase_paid_tokens_spent(message.from_user, paid_tokens_to_pay)
-
-            transaction_id = await add_transaction_record(
-                message.from_user.id,
-                free_tokens_to_pay,
-                paid_tokens_to_pay,
-                'remove'
-            )
+        if not await send_fragment(message, message.from_user, book, data["words"], fragment, search_type):
+            raise Exception("Not enough tokens available on fragment search, but words was already checked.")
 
-            await message.answer(
-                l18n.get("ru", "messages", "fragment", "fragment").format(
-                    title=book.title,
-                    author=book.author,
-                    words_query=', '.join(data["words"]),
-                    fragment=translated_fragment
-                ),
-                reply_markup=get_menu_keyboard(message.from_user.username),
-                link_preview_options=LinkPreviewOptions(is_disabled=True)
-            )
+        store_pending_fragments(message.chat.id, book, data["words"], search_type, more_fragments)
+        if more_fragments:
+            await offer_another_fragment(message)
 
-            await add_fragment_record(message.from_user.id, book.id, data["words"], fragment, translated_fragment,
-                                      search_type, transaction_id)
-        else:
-            raise Exception("Not enough tokens available on fragment search, but words was already checked.")
+
+@fragment_router.callback_query(F.data == "another_fragment")
+async def another_fragment_callback(callback_query: CallbackQuery, state: FSMContext) -> None:
+    await callback_query.answer()
+    message = callback_query.message
+    pending = pending_fragments.get(message.chat.id)
+    if pending is None or pending.expires_at <= time.monotonic():
+        pending_fragments.pop(message.chat.id, None)
+        await message.answer(
+            l18n.get("ru", "messages", "fragment", "another_fragment_expired"),
+            reply_markup=get_menu_keyboard(callback_query.from_user.username)
+        )
+        return
+
+    # Taken before sending, so repeated presses do not send the same fragment twice
+    fragment, words_found = pending.fragments.pop(0)
+    if not await send_fragment(message, callback_query.from_user, pending.book, pending.words, fragment,
+                               pending.search_type):
+        pending.fragments.insert(0, (fragment, words_found))
+        await message.answer(
+            l18n.get("ru", "messages", "fragment", "lack_of_tokens"),
+            reply_markup=get_menu_keyboard(callback_query.from_user.username)
+        )
+        return
+
+    if pending.fragments:
+        await offer_another_fragment(message)
+    else:
+        pending_fragments.pop(message.chat.id, None)
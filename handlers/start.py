@@ -3,6 +3,7 @@ from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery
 
+from utils import prefetch
 from utils.l18n import l18n
 from utils.database import get_user_data
 from utils.keyboards import get_menu_keyboard
@@ -30,5 +31,6 @@ async def cancel_callback(callback_query: CallbackQuery, state: FSMContext):
 
 @start_router.message(F.text.casefold() == l18n.get("ru", "buttons", "cancel").casefold())
 async def cancel_handler(message: Message, state: FSMContext) -> None:
+    prefetch.cancel_prefetch(message.chat.id)
     await state.clear()
     await command_start_handler(message)
@@ -0,0 +1,2 @@
+DELETE FROM public.alter_bot_wordscount
+WHERE book_id = ANY($1::bigint[]);
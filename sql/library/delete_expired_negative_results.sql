@@ -0,0 +1,2 @@
+DELETE FROM public.uchibot_negative_results
+WHERE "timestamp" <= CURRENT_TIMESTAMP - $1::interval;
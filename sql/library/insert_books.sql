@@ -0,0 +1,6 @@
+INSERT INTO public.alter_bot_book (
+    title, author, url, paragraph_count, uncompressed_size, encoding
+)
+SELECT *
+FROM unnest($1::text[], $2::text[], $3::text[], $4::integer[], $5::bigint[], $6::text[])
+RETURNING id, url;
@@ -0,0 +1,7 @@
+INSERT INTO public.uchibot_negative_results (
+    words, length_bucket, book_id
+)
+VALUES (
+    $1, $2, $3
+)
+ON CONFLICT (words, length_bucket, book_id) DO UPDATE SET "timestamp" = CURRENT_TIMESTAMP;
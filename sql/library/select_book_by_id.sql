@@ -1,3 +1,3 @@
-SELECT id, title, author, url
+SELECT id, title, author, url, encoding
 FROM alter_bot_book
 WHERE id = $1
\ No newline at end of file
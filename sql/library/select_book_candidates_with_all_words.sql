@@ -0,0 +1,15 @@
+SELECT wc.book_id,
+       b.url,
+       b.paragraph_count,
+       b.uncompressed_size,
+       array_agg(wc.word) AS words,
+       array_agg(wc.frequency) AS frequencies
+FROM public.alter_bot_wordscount wc
+JOIN public.alter_bot_book b ON b.id = wc.book_id
+WHERE wc.word = ANY($1::text[])
+  AND wc.frequency >= $2
+GROUP BY wc.book_id, b.url, b.paragraph_count, b.uncompressed_size
+HAVING COUNT(DISTINCT wc.word) = cardinality($1::text[])
+   AND ($3::integer IS NULL OR MIN(wc.frequency) < $3 OR (MIN(wc.frequency) = $3 AND wc.book_id > $4::bigint))
+ORDER BY MIN(wc.frequency) DESC, wc.book_id
+LIMIT $5;
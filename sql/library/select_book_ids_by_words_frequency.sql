@@ -1,7 +1,12 @@
-SELECT book_id,
-       SUM(frequency) AS total_frequency
-FROM public.alter_bot_wordscount
-WHERE word = ANY(ARRAY[$1::text[]])
-GROUP BY book_id
-HAVING SUM(frequency) >= $2
-ORDER BY total_frequency DESC;
+SELECT wc.book_id,
+       b.url,
+       b.paragraph_count,
+       b.uncompressed_size,
+       array_agg(wc.word) AS words,
+       array_agg(wc.frequency) AS frequencies
+FROM public.alter_bot_wordscount wc
+JOIN public.alter_bot_book b ON b.id = wc.book_id
+WHERE wc.word = ANY(ARRAY[$1::text[]])
+GROUP BY wc.book_id, b.url, b.paragraph_count, b.uncompressed_size
+HAVING SUM(wc.frequency) >= $2
+ORDER BY SUM(wc.frequency) DESC;
@@ -0,0 +1,2 @@
+SELECT id, url
+FROM alter_bot_book;
@@ -0,0 +1,2 @@
+SELECT archive, mtime
+FROM public.uchibot_ingested_archives;
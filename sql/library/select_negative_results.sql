@@ -0,0 +1,4 @@
+SELECT book_id, length_bucket
+FROM public.uchibot_negative_results
+WHERE words = $1::text[]
+  AND "timestamp" > CURRENT_TIMESTAMP - $2::interval;
@@ -0,0 +1,7 @@
+UPDATE public.alter_bot_book
+SET title = $2,
+    author = $3,
+    paragraph_count = $4,
+    uncompressed_size = $5,
+    encoding = $6
+WHERE id = $1;
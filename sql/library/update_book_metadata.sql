@@ -0,0 +1,4 @@
+UPDATE public.alter_bot_book
+SET paragraph_count = $2,
+    uncompressed_size = $3
+WHERE id = $1;
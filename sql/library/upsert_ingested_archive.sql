@@ -0,0 +1,7 @@
+INSERT INTO public.uchibot_ingested_archives (
+    archive, mtime
+)
+VALUES (
+    $1, $2
+)
+ON CONFLICT (archive) DO UPDATE SET mtime = EXCLUDED.mtime, "timestamp" = CURRENT_TIMESTAMP;
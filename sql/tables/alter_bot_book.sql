@@ -38,4 +38,14 @@ CREATE INDEX IF NOT EXISTS idx_books_title_author_trgm
 CREATE INDEX IF NOT EXISTS idx_books_trgm
     ON public.alter_bot_book USING gin
     (((title::text || ' '::text) || author::text) COLLATE pg_catalog."default" gin_trgm_ops)
-    TABLESPACE pg_default;
\ No newline at end of file
+    TABLESPACE pg_default;
+-- Size of the book, filled when the library is ingested
+
+ALTER TABLE IF EXISTS public.alter_bot_book
+    ADD COLUMN IF NOT EXISTS paragraph_count integer,
+    ADD COLUMN IF NOT EXISTS uncompressed_size bigint;
+
+-- Encoding of the file, so search does not have to detect it again
+
+ALTER TABLE IF EXISTS public.alter_bot_book
+    ADD COLUMN IF NOT EXISTS encoding character varying COLLATE pg_catalog."default";
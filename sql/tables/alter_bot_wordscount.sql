@@ -0,0 +1,28 @@
+-- Table: public.alter_bot_wordscount
+
+-- DROP TABLE IF EXISTS public.alter_bot_wordscount;
+
+CREATE TABLE IF NOT EXISTS public.alter_bot_wordscount
+(
+    book_id bigint NOT NULL,
+    word character varying COLLATE pg_catalog."default" NOT NULL,
+    frequency integer NOT NULL,
+    CONSTRAINT alter_bot_wordscount_book_id_fkey FOREIGN KEY (book_id)
+        REFERENCES public.alter_bot_book (id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE CASCADE
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.alter_bot_wordscount
+    OWNER to postgres;
+-- Index: idx_wordscount_word_book
+
+-- DROP INDEX IF EXISTS public.idx_wordscount_word_book;
+
+CREATE INDEX IF NOT EXISTS idx_wordscount_word_book
+    ON public.alter_bot_wordscount USING btree
+    (word COLLATE pg_catalog."default" ASC NULLS LAST, book_id ASC NULLS LAST)
+    INCLUDE (frequency)
+    TABLESPACE pg_default;
@@ -0,0 +1,16 @@
+-- Table: public.uchibot_ingested_archives
+
+-- DROP TABLE IF EXISTS public.uchibot_ingested_archives;
+
+CREATE TABLE IF NOT EXISTS public.uchibot_ingested_archives
+(
+    archive character varying COLLATE pg_catalog."default" NOT NULL,
+    mtime double precision NOT NULL,
+    "timestamp" timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uchibot_ingested_archives_pkey PRIMARY KEY (archive)
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.uchibot_ingested_archives
+    OWNER to postgres;
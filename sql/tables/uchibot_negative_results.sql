@@ -0,0 +1,29 @@
+-- Table: public.uchibot_negative_results
+
+-- DROP TABLE IF EXISTS public.uchibot_negative_results;
+
+CREATE TABLE IF NOT EXISTS public.uchibot_negative_results
+(
+    words text[] COLLATE pg_catalog."default" NOT NULL,
+    length_bucket integer NOT NULL,
+    book_id bigint NOT NULL,
+    "timestamp" timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uchibot_negative_results_pkey PRIMARY KEY (words, length_bucket, book_id),
+    CONSTRAINT fk_alter_bot_book FOREIGN KEY (book_id)
+        REFERENCES public.alter_bot_book (id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE CASCADE
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.uchibot_negative_results
+    OWNER to postgres;
+-- Index: idx_negative_results_timestamp
+
+-- DROP INDEX IF EXISTS public.idx_negative_results_timestamp;
+
+CREATE INDEX IF NOT EXISTS idx_negative_results_timestamp
+    ON public.uchibot_negative_results USING btree
+    ("timestamp" ASC NULLS LAST)
+    TABLESPACE pg_default;
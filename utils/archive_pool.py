@@ -0,0 +1,107 @@
+import os
+import time
+import threading
+
+from utils.config_parser import read_config
+
+
+class ArchiveHandle:
+    """
+    Open handle of a library archive shared between readers.
+    Reads are positional, so threads read members of the same archive concurrently without moving a shared offset.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.identity = (stat.st_ino, stat.st_mtime, stat.st_size)
+        self.users = 0
+        self.last_used = time.monotonic()
+        # Only needed where os.pread is not available, e.g. on Windows
+        self.lock = threading.Lock()
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self.file.fileno(), size, offset)
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ArchivePool:
+    """
+    Bounded pool of open archive handles keyed by archive path. Idle handles are closed first.
+    Handles idle for longer than the idle timeout are closed whenever a handle is acquired, so every
+    search worker process sweeps its own pool.
+    """
+    def __init__(self, max_handles: int = 16, idle_timeout: float = 300):
+        self.max_handles = max_handles
+        self.idle_timeout = idle_timeout
+        self.handles: dict[str, ArchiveHandle] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, path: str) -> ArchiveHandle:
+        stat = os.stat(path)
+        with self.lock:
+            self._close_idle()
+            handle = self.handles.get(path)
+            if handle is not None and handle.identity != (stat.st_ino, stat.st_mtime, stat.st_size):
+                # The archive was replaced, new readers get a fresh handle
+                del self.handles[path]
+                self._close_if_unused(handle)
+                handle = None
+
+            if handle is None:
+                handle = ArchiveHandle(path)
+                self.handles[path] = handle
+                self._evict(self.max_handles)
+
+            handle.users += 1
+            handle.last_used = time.monotonic()
+            return handle
+
+    def release(self, handle: ArchiveHandle) -> None:
+        with self.lock:
+            handle.users -= 1
+            handle.last_used = time.monotonic()
+            if self.handles.get(handle.path) is not handle:
+                self._close_if_unused(handle)
+
+    def _close_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        for path, handle in list(self.handles.items()):
+            if handle.users == 0 and handle.last_used < deadline:
+                del self.handles[path]
+                handle.close()
+
+    def _evict(self, max_handles: int) -> None:
+        unused = sorted((handle for handle in self.handles.values() if handle.users == 0),
+                        key=lambda handle: handle.last_used)
+        for handle in unused[:max(0, len(self.handles) - max_handles)]:
+            del self.handles[handle.path]
+            handle.close()
+
+    @staticmethod
+    def _close_if_unused(handle: ArchiveHandle) -> None:
+        if handle.users == 0:
+            handle.close()
+
+
+archive_pool: ArchivePool | None = None
+ARCHIVE_POOL_LOCK = threading.Lock()
+
+
+def get_archive_pool() -> ArchivePool:
+    """Returns the archive handle pool of this process, creating it on first use."""
+    global archive_pool
+    with ARCHIVE_POOL_LOCK:
+        if archive_pool is None:
+            library_config = read_config('config.ini')['Library']
+            archive_pool = ArchivePool(
+                max_handles=int(library_config.get('archive_handles', 16)),
+                idle_timeout=float(library_config.get('archive_idle_seconds', 300))
+            )
+        return archive_pool
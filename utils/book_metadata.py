@@ -0,0 +1,80 @@
+"""
+Stores the number of paragraphs and the uncompressed size of every library book in the catalog,
+so full search can skip or defer expensive books without opening their archives.
+
+Usage: python -m utils.book_metadata [--archive NAME] [--workers N]
+"""
+import os
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import database, library, inverted_index, paragraph_store, zip_index
+from utils.config_parser import read_config
+
+
+def get_paragraph_count(zip_file_name: str, fb2_file_name: str, source_mtime: float) -> int:
+    """
+    Takes the number of paragraphs from the book index or the paragraph store if the book is in one of them,
+    otherwise parses the book without storing its text.
+    """
+    index = inverted_index.load_index(zip_file_name, fb2_file_name, source_mtime)
+    if index is not None:
+        with index:
+            return len(index)
+    paragraphs = paragraph_store.open_paragraphs(zip_file_name, fb2_file_name, source_mtime)
+    if paragraphs is not None:
+        return len(paragraphs)
+    return len(library.extract_paragraphs_from_zip(library.get_archive_path(zip_file_name), fb2_file_name))
+
+
+def collect_archive_metadata(zip_file_name: str) -> list[tuple[str, str, int, int]]:
+    """Returns the archive name, file name, number of paragraphs and uncompressed size of every book in an archive."""
+    zip_file_path = library.get_archive_path(zip_file_name)
+    source_mtime = os.path.getmtime(zip_file_path)
+    metadata = []
+    for fb2_file_name in zip_index.get_member_names(zip_file_path):
+        try:
+            paragraph_count = get_paragraph_count(zip_file_name, fb2_file_name, source_mtime)
+        except Exception as error:
+            print(f"Could not parse {zip_file_name}/{fb2_file_name}: {error}")
+            continue
+        member = zip_index.get_member(zip_file_path, fb2_file_name)
+        metadata.append((zip_file_name, fb2_file_name, paragraph_count, member.file_size))
+    print(f"Collected metadata of {len(metadata)} books of {zip_file_name}.")
+    return metadata
+
+
+async def store_metadata(archives_metadata: list[list[tuple[str, str, int, int]]]) -> int:
+    """Stores metadata of books present in the catalog. Returns the number of books updated."""
+    await database.init_pool()
+    try:
+        book_ids = await database.get_book_locations()
+        rows = [
+            (book_ids[zip_file_name, fb2_file_name], paragraph_count, uncompressed_size)
+            for metadata in archives_metadata
+            for zip_file_name, fb2_file_name, paragraph_count, uncompressed_size in metadata
+            if (zip_file_name, fb2_file_name) in book_ids
+        ]
+        await database.update_book_metadata(rows)
+    finally:
+        await database.pool.close()
+    return len(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', action='append', help="Process only this archive, may be repeated")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    library_root = read_config('config.ini')['Library']['library_root']
+    archives = args.archive or sorted(name for name in os.listdir(library_root) if name.endswith('.zip'))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        archives_metadata = list(executor.map(collect_archive_metadata, archives))
+    updated = asyncio.run(store_metadata(archives_metadata))
+    print(f"Updated {updated} books in {len(archives)} archives.")
+
+
+if __name__ == "__main__":
+    main()
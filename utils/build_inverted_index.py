@@ -0,0 +1,61 @@
+"""
+Builds per-book inverted indexes of the whole library, skipping books indexed for the current archive version.
+
+Usage: python -m utils.build_inverted_index [--archive NAME] [--workers N]
+"""
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import library, inverted_index, paragraph_store, zip_index
+from utils.config_parser import read_config
+
+
+def build_book_index(zip_file_name: str, fb2_file_name: str) -> bool:
+    """
+    Builds the index of a book unless an index of the current archive version exists. Returns True if built.
+    The text of the book is not stored, fragments found through the index are read from the paragraph store,
+    the repacked corpus, or parsed and stored on the first hit within the store budget.
+    """
+    source_mtime = os.path.getmtime(library.get_archive_path(zip_file_name))
+    index = inverted_index.load_index(zip_file_name, fb2_file_name, source_mtime)
+    if index is not None:
+        index.close()
+        return False
+
+    paragraphs = paragraph_store.open_paragraphs(zip_file_name, fb2_file_name, source_mtime)
+    if paragraphs is None:
+        paragraphs = library.extract_paragraphs_from_zip(library.get_archive_path(zip_file_name), fb2_file_name)
+    inverted_index.write_index(
+        inverted_index.index_path(zip_file_name, fb2_file_name), source_mtime, paragraphs, library.tokenize
+    )
+    return True
+
+
+def build_archive_index(zip_file_name: str) -> int:
+    """Builds indexes of all books in an archive. Returns the number of books indexed."""
+    built = 0
+    for fb2_file_name in zip_index.get_member_names(library.get_archive_path(zip_file_name)):
+        try:
+            built += build_book_index(zip_file_name, fb2_file_name)
+        except Exception as error:
+            print(f"Could not index {zip_file_name}/{fb2_file_name}: {error}")
+    print(f"Indexed {built} books of {zip_file_name}.")
+    return built
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', action='append', help="Index only this archive, may be repeated")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    library_root = read_config('config.ini')['Library']['library_root']
+    archives = args.archive or sorted(name for name in os.listdir(library_root) if name.endswith('.zip'))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        built = sum(executor.map(build_archive_index, archives))
+    print(f"Indexed {built} books in {len(archives)} archives.")
+
+
+if __name__ == "__main__":
+    main()
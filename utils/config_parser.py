@@ -12,7 +12,29 @@ def create_config(filename: str) -> None:
                           'DB_PASSWORD': '<PASSWORD>',
                           'DB_HOST': '172.17.0.1',
                           'DB_PORT': '5432'}
-    config['Library'] = {'LIBRARY_ROOT': '<LIBRARY ROOT>', }
+    config['Library'] = {'LIBRARY_ROOT': '<LIBRARY ROOT>',
+                         'ARCHIVE_HANDLES': '16',
+                         'ARCHIVE_IDLE_SECONDS': '300',
+                         'PARAGRAPH_STORE_SIZE_MB': '4096',
+                         'XML_PARSER': 'etree'}
+    config['Search'] = {'WORKERS': '0',
+                        'TASK_TIMEOUT': '60',
+                        'FULL_SEARCH_CONCURRENCY': '4',
+                        'FULL_SEARCH_TIME_BUDGET': '20',
+                        'FULL_SEARCH_BOOK_BUDGET': '200',
+                        'CANDIDATE_MODE': 'all_words',
+                        'MIN_WORD_FREQUENCY': '3',
+                        'CANDIDATE_BATCH_SIZE': '50',
+                        'NEGATIVE_CACHE_TTL_HOURS': '168',
+                        'RESULT_CACHE_ENTRIES': '1024',
+                        'RESULT_CACHE_SIZE_MB': '64',
+                        'PREFETCH_MAX_INFLIGHT': '2',
+                        'PREFETCH_MAX_MB': '64',
+                        'FRAGMENTS_PER_SEARCH': '3',
+                        'PENDING_FRAGMENTS_TTL_SECONDS': '900',
+                        'MAX_BOOK_PARAGRAPHS': '150000',
+                        'MAX_BOOK_SIZE_MB': '64',
+                        'DEFER_BOOK_SIZE_MB': '8'}
 
     with open(filename, 'w') as configfile:
         config.write(configfile)
@@ -0,0 +1,187 @@
+import os
+import mmap
+import json
+import struct
+import threading
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CORPUS_DIR = os.path.join(PROJECT_ROOT, '.corpus')
+
+# One file per archive, all little-endian:
+#   header: magic, version, archive mtime, offset of the directory
+#   per book: paragraph and block counts,
+#             (P + 1) uint64 offsets of paragraphs in the uncompressed text of the book,
+#             (B + 1) uint32 first paragraph of every block, (B + 1) uint64 file offsets of blocks,
+#             B zstd frames of consecutive paragraphs
+#   directory: json object of book offsets by fb2 file name
+CORPUS_MAGIC = b'MLZC'
+CORPUS_VERSION = 1
+HEADER = struct.Struct('<4sHxxdQ')
+BOOK_HEADER = struct.Struct('<II')
+
+# Paragraphs are packed into blocks of at least this many uncompressed bytes
+BLOCK_SIZE = 64 * 1024
+
+# Corpora opened by this process, validated by the corpus file mtime and size on every lookup
+open_corpora: dict[str, 'Corpus'] = {}
+CORPUS_LOCK = threading.Lock()
+
+
+class CorpusBook(NamedTuple):
+    offsets: np.ndarray
+    block_starts: np.ndarray
+    block_offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+def corpus_path(zip_file_name: str) -> str:
+    return os.path.join(CORPUS_DIR, os.path.splitext(zip_file_name)[0] + '.mlzc')
+
+
+def pack_book(paragraphs: list[str], compressor, position: int) -> bytes:
+    """Packs paragraphs of a book into blocks, position is the file offset the book is written at."""
+    encoded = [paragraph.encode('utf-8') for paragraph in paragraphs]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    np.cumsum([len(paragraph) for paragraph in encoded], out=offsets[1:])
+
+    block_starts = [0]
+    for i in range(1, len(encoded) + 1):
+        if offsets[i] - offsets[block_starts[-1]] >= BLOCK_SIZE or (i == len(encoded) and i > block_starts[-1]):
+            block_starts.append(i)
+    frames = [
+        compressor.compress(b''.join(encoded[start:stop])) for start, stop in zip(block_starts, block_starts[1:])
+    ]
+
+    position += BOOK_HEADER.size + offsets.nbytes + 4 * len(block_starts) + 8 * len(block_starts)
+    block_offsets = np.zeros(len(block_starts), dtype='<u8')
+    np.cumsum([len(frame) for frame in frames], out=block_offsets[1:])
+    block_offsets += position
+
+    return b''.join((
+        BOOK_HEADER.pack(len(encoded), len(frames)),
+        offsets.tobytes(),
+        np.array(block_starts, dtype='<u4').tobytes(),
+        block_offsets.tobytes(),
+        *frames
+    ))
+
+
+def write_corpus(path: str, source_mtime: float, books: Iterable[tuple[str, list[str]]], level: int = 10) -> int:
+    """Writes paragraphs of books of an archive as a corpus file. Returns the number of books written."""
+    compressor = zstandard.ZstdCompressor(level=level)
+    directory = {}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION, source_mtime, 0))
+        for fb2_file_name, paragraphs in books:
+            directory[fb2_file_name] = file.tell()
+            file.write(pack_book(paragraphs, compressor, file.tell()))
+        directory_offset = file.tell()
+        file.write(json.dumps(directory, ensure_ascii=False).encode('utf-8'))
+        file.seek(0)
+        file.write(HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION, source_mtime, directory_offset))
+    os.replace(temp_path, path)
+    return len(directory)
+
+
+class Corpus:
+    """Memory-mapped corpus of an archive. Only the index of the looked up book and its needed blocks are read."""
+    def __init__(self, data: mmap.mmap, stat: os.stat_result):
+        self.data = data
+        self.stat = stat
+        _, _, self.source_mtime, directory_offset = HEADER.unpack_from(data)
+        self.directory: dict[str, int] = json.loads(data[directory_offset:].decode('utf-8'))
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def book(self, fb2_file_name: str) -> CorpusBook | None:
+        position = self.directory.get(fb2_file_name)
+        if position is None:
+            return None
+        paragraph_count, block_count = BOOK_HEADER.unpack_from(self.data, position)
+        position += BOOK_HEADER.size
+        offsets = np.frombuffer(self.data, dtype='<u8', count=paragraph_count + 1, offset=position)
+        position += offsets.nbytes
+        block_starts = np.frombuffer(self.data, dtype='<u4', count=block_count + 1, offset=position)
+        position += block_starts.nbytes
+        block_offsets = np.frombuffer(self.data, dtype='<u8', count=block_count + 1, offset=position)
+        return CorpusBook(offsets, block_starts, block_offsets)
+
+    def read_paragraphs(self, book: CorpusBook, start: int, stop: int) -> list[str]:
+        """Decompresses only the blocks holding paragraphs start..stop - 1."""
+        if start == stop:
+            return []
+        first_block = int(np.searchsorted(book.block_starts, start, side='right')) - 1
+        last_block = int(np.searchsorted(book.block_starts, stop - 1, side='right')) - 1
+        text = b''.join(
+            self.decompressor.decompress(self.data[int(book.block_offsets[block]):int(book.block_offsets[block + 1])])
+            for block in range(first_block, last_block + 1)
+        )
+        base = int(book.offsets[book.block_starts[first_block]])
+        offsets = book.offsets[start:stop + 1].astype(np.int64) - base
+        return [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(stop - start)]
+
+
+def open_corpus(zip_file_name: str, source_mtime: float) -> Corpus | None:
+    """Returns the corpus of the archive, or None if there is none for this version of the archive."""
+    if zstandard is None:
+        return None
+    path = corpus_path(zip_file_name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    with CORPUS_LOCK:
+        corpus = open_corpora.get(path)
+        if corpus is None or (corpus.stat.st_mtime, corpus.stat.st_size) != (stat.st_mtime, stat.st_size):
+            # A replaced corpus may still be read by another thread, its mapping is closed once unreferenced
+            try:
+                with open(path, 'rb') as file:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return None
+            try:
+                magic, version, _, _ = HEADER.unpack_from(data)
+            except struct.error:
+                magic = version = None
+            if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+                data.close()
+                return None
+            corpus = open_corpora[path] = Corpus(data, stat)
+    return corpus if corpus.source_mtime == source_mtime else None
+
+
+def has_book(zip_file_name: str, fb2_file_name: str, source_mtime: float) -> bool:
+    corpus = open_corpus(zip_file_name, source_mtime)
+    return corpus is not None and fb2_file_name in corpus.directory
+
+
+def load_paragraph_range(zip_file_name: str, fb2_file_name: str, source_mtime: float,
+                         start: int, stop: int | None = None) -> list[str] | None:
+    """
+    Loads paragraphs start..stop - 1 of the book, all remaining ones if stop is None.
+    Returns None if the book is not in the corpus of this version of its archive.
+    """
+    corpus = open_corpus(zip_file_name, source_mtime)
+    book = corpus.book(fb2_file_name) if corpus is not None else None
+    if book is None:
+        return None
+    stop = len(book) if stop is None else stop
+    if not 0 <= start <= stop <= len(book):
+        return None
+    return corpus.read_paragraphs(book, start, stop)
+
+
+def load_paragraphs(zip_file_name: str, fb2_file_name: str, source_mtime: float) -> list[str] | None:
+    return load_paragraph_range(zip_file_name, fb2_file_name, source_mtime, 0)
@@ -1,15 +1,20 @@
+from __future__ import annotations
+
 import os
-from typing import Callable, Literal
+from typing import Callable, Literal, AsyncIterator, Iterable, TYPE_CHECKING
 from functools import wraps
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
 from dataclasses import dataclass
 
 import asyncpg
-from aiogram.types import User
 from asyncpg import Pool
 
 from utils.config_parser import read_config
 
+if TYPE_CHECKING:
+    # Only annotations, search workers import this module without aiogram
+    from aiogram.types import User
+
 ACCURACY_THRESHOLD = 0.6
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 SQL_DIR = os.path.join(PROJECT_ROOT, 'sql')
@@ -44,6 +49,19 @@ class SQLFiles:
     SELECT_BOOK_BY_URL = "library/select_book_by_url.sql"
     SELECT_BOOKS_BY_AUTHOR = "library/select_books_by_author.sql"
     SELECT_BOOK_IDS_BY_WORDS_FREQUENCY = "library/select_book_ids_by_words_frequency.sql"
+    SELECT_BOOK_CANDIDATES_WITH_ALL_WORDS = "library/select_book_candidates_with_all_words.sql"
+    SELECT_BOOK_LOCATIONS = "library/select_book_locations.sql"
+    UPDATE_BOOK_METADATA = "library/update_book_metadata.sql"
+
+    SELECT_INGESTED_ARCHIVES = "library/select_ingested_archives.sql"
+    UPSERT_INGESTED_ARCHIVE = "library/upsert_ingested_archive.sql"
+    INSERT_BOOKS = "library/insert_books.sql"
+    UPDATE_BOOK = "library/update_book.sql"
+    DELETE_BOOKS_WORDS = "library/delete_books_words.sql"
+
+    SELECT_NEGATIVE_RESULTS = "library/select_negative_results.sql"
+    INSERT_NEGATIVE_RESULT = "library/insert_negative_result.sql"
+    DELETE_EXPIRED_NEGATIVE_RESULTS = "library/delete_expired_negative_results.sql"
 
     SELECT_REPORT_DATA = "select_report_data.sql"
 
@@ -71,18 +89,59 @@ class SearchResultSimilarityCheck:
 
 
 class BookSearchResult(SearchResultSimilarityCheck):
-    def __init__(self, id: int = None, title: str = None, author: str = None, url: str = None, similarity: float = .0):
+    def __init__(self, id: int = None, title: str = None, author: str = None, url: str = None, similarity: float = .0,
+                 encoding: str = None):
         super().__init__(similarity)
         self.id: int = id
         self.title: str = title
         self.author: str = author
         self.archive: str = url.split('/')[-2]
         self.filename: str = url.split('/')[-1]
+        # Encoding of the file found when the library was ingested
+        self.encoding: str | None = encoding
 
     def __iter__(self):
         return iter((self.id, self.title, self.author, self.archive, self.filename, self.similarity))
 
 
+@dataclass
+class BookCandidate:
+    book_id: int
+    url: str
+    frequencies: dict[str, int]
+    paragraph_count: int | None = None
+    uncompressed_size: int | None = None
+
+    @classmethod
+    def from_row(cls, row) -> 'BookCandidate':
+        return cls(
+            row["book_id"],
+            row["url"],
+            dict(zip(row["words"], row["frequencies"])),
+            row["paragraph_count"],
+            row["uncompressed_size"]
+        )
+
+    @property
+    def archive(self) -> str:
+        return self.url.split('/')[-2]
+
+    @property
+    def filename(self) -> str:
+        return self.url.split('/')[-1]
+
+
+@dataclass
+class CatalogBook:
+    filename: str
+    title: str
+    author: str
+    paragraph_count: int
+    uncompressed_size: int
+    word_counts: dict[str, int]
+    encoding: str | None = None
+
+
 class AuthorSearchResult(SearchResultSimilarityCheck):
     def __init__(self, author: str, similarity: float):
         super().__init__(similarity)
@@ -98,20 +157,21 @@ async def load_sql(filename: str):
         return file.read()
 
 
-async def connect_to_db_pool():
+async def connect_to_db_pool(**pool_options):
     config = read_config("config.ini")
     return await asyncpg.create_pool(
         host=config["Database"]["db_host"],
         port=config["Database"]["db_port"],
         user=config["Database"]["db_user"],
         password=config["Database"]["db_password"],
-        database=config["Database"]["db_name"]
+        database=config["Database"]["db_name"],
+        **pool_options
     )
 
 
-async def init_pool():
+async def init_pool(**pool_options):
     global pool
-    pool = await connect_to_db_pool()
+    pool = await connect_to_db_pool(**pool_options)
 
 
 def check_user(func: Callable):
@@ -354,21 +414,171 @@ async def get_book_by_id(book_id: int) -> BookSearchResult:
     async with pool.acquire() as conn:
         sql_query = await load_sql(SQLFiles.SELECT_BOOK_BY_ID)
         row = await conn.fetchrow(sql_query, book_id)
-    return BookSearchResult(*row, 1)
+    return BookSearchResult(row["id"], row["title"], row["author"], row["url"], 1, row["encoding"])
 
 
 async def get_book_by_url(url: str) -> BookSearchResult:
     async with pool.acquire() as conn:
         sql_query = await load_sql(SQLFiles.SELECT_BOOK_BY_URL)
         row = await conn.fetchrow(sql_query, url)
-    return BookSearchResult(*row, 1)
+    return BookSearchResult(row["id"], row["title"], row["author"], row["url"], 1, row["encoding"])
 
 
-async def get_book_ids_by_words_frequency(word_list: list[str], min_frequency: int = 20) -> list[int]:
+async def get_book_candidates_by_words_frequency(word_list: list[str], min_frequency: int = 20) -> list[BookCandidate]:
+    """
+    Returns books where the words occur at least min_frequency times in total,
+    with the frequency of every word found in the book.
+    """
     async with pool.acquire() as conn:
         sql_query = await load_sql(SQLFiles.SELECT_BOOK_IDS_BY_WORDS_FREQUENCY)
         rows = await conn.fetch(sql_query, word_list, min_frequency)
-    return [x["book_id"] for x in rows]
+    return [
+        BookCandidate.from_row(row)
+        for row in rows
+    ]
+
+
+async def iter_book_candidates_with_all_words(word_list: list[str], min_frequency: int = 3,
+                                              batch_size: int = 50) -> AsyncIterator[list[BookCandidate]]:
+    """
+    Yields batches of books where every word occurs at least min_frequency times,
+    books with the highest frequency of the rarest word first.
+    Every batch is a separate query continuing after the last book of the previous one,
+    so no connection is held between batches.
+    """
+    word_list = list(dict.fromkeys(word_list))
+    sql_query = await load_sql(SQLFiles.SELECT_BOOK_CANDIDATES_WITH_ALL_WORDS)
+    last_frequency = last_book_id = None
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(sql_query, word_list, min_frequency, last_frequency, last_book_id, batch_size)
+        if not rows:
+            return
+        batch = [BookCandidate.from_row(row) for row in rows]
+        yield batch
+        if len(rows) < batch_size:
+            return
+        last_frequency = min(batch[-1].frequencies.values())
+        last_book_id = batch[-1].book_id
+
+
+async def get_negative_results(words: list[str], ttl: timedelta) -> set[tuple[int, int]]:
+    """
+    Returns (book_id, length_bucket) pairs where no fragment with the words was found within the last ttl.
+    :param words: Normalized sorted words
+    """
+    async with pool.acquire() as conn:
+        sql_query = await load_sql(SQLFiles.SELECT_NEGATIVE_RESULTS)
+        rows = await conn.fetch(sql_query, words, ttl)
+    return {(row["book_id"], row["length_bucket"]) for row in rows}
+
+
+async def add_negative_result(words: list[str], length_bucket: int, book_id: int) -> None:
+    async with pool.acquire() as conn:
+        sql_query = await load_sql(SQLFiles.INSERT_NEGATIVE_RESULT)
+        await conn.execute(sql_query, words, length_bucket, book_id)
+
+
+async def delete_expired_negative_results(ttl: timedelta) -> None:
+    async with pool.acquire() as conn:
+        sql_query = await load_sql(SQLFiles.DELETE_EXPIRED_NEGATIVE_RESULTS)
+        await conn.execute(sql_query, ttl)
+
+
+async def get_book_locations() -> dict[tuple[str, str], int]:
+    """Returns ids of all books by their archive and file name."""
+    async with pool.acquire() as conn:
+        sql_query = await load_sql(SQLFiles.SELECT_BOOK_LOCATIONS)
+        rows = await conn.fetch(sql_query)
+    return {tuple(row["url"].split('/')[-2:]): row["id"] for row in rows}
+
+
+async def update_book_metadata(metadata: list[tuple[int, int, int]]) -> None:
+    """
+    Stores sizes of books.
+    :param metadata: Book id, number of paragraphs and uncompressed size in bytes of every book
+    """
+    async with pool.acquire() as conn:
+        sql_query = await load_sql(SQLFiles.UPDATE_BOOK_METADATA)
+        await conn.executemany(sql_query, metadata)
+
+
+async def get_ingested_archives() -> dict[str, float]:
+    """Returns archive mtimes as of their last ingestion."""
+    async with pool.acquire() as conn:
+        sql_query = await load_sql(SQLFiles.SELECT_INGESTED_ARCHIVES)
+        rows = await conn.fetch(sql_query)
+    return {row["archive"]: row["mtime"] for row in rows}
+
+
+async def ingest_archive_books(archive: str, mtime: float, books: Iterable[CatalogBook], book_ids: dict[str, int],
+                               batch_size: int = 100) -> int:
+    """
+    Stores books of an archive and their word counts in one transaction, bulk loading words with COPY.
+    Books already in the catalog are updated in place, so their fragments are kept. Books gone from the archive
+    stay in the catalog without words, so they are not search candidates anymore.
+    :param books: Parsed books, consumed a batch at a time
+    :param book_ids: Ids of books of the archive in the catalog by file name
+    :return: Number of books stored
+    """
+    stored = 0
+    stale_ids = dict(book_ids)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            update_query = await load_sql(SQLFiles.UPDATE_BOOK)
+            insert_query = await load_sql(SQLFiles.INSERT_BOOKS)
+            delete_words_query = await load_sql(SQLFiles.DELETE_BOOKS_WORDS)
+
+            async def store_batch(batch: list[CatalogBook]) -> None:
+                existing = [book for book in batch if book.filename in book_ids]
+                new = [book for book in batch if book.filename not in book_ids]
+                ids = {book.filename: book_ids[book.filename] for book in existing}
+
+                if existing:
+                    await conn.executemany(update_query, [
+                        (ids[book.filename], book.title, book.author, book.paragraph_count, book.uncompressed_size,
+                         book.encoding)
+                        for book in existing
+                    ])
+                if new:
+                    rows = await conn.fetch(
+                        insert_query,
+                        [book.title for book in new],
+                        [book.author for book in new],
+                        [f"{archive}/{book.filename}" for book in new],
+                        [book.paragraph_count for book in new],
+                        [book.uncompressed_size for book in new],
+                        [book.encoding for book in new]
+                    )
+                    ids.update({row["url"].split('/')[-1]: row["id"] for row in rows})
+
+                await conn.execute(delete_words_query, list(ids.values()))
+                await conn.copy_records_to_table(
+                    'alter_bot_wordscount',
+                    schema_name='public',
+                    columns=['book_id', 'word', 'frequency'],
+                    records=[
+                        (ids[book.filename], word, frequency)
+                        for book in batch
+                        for word, frequency in book.word_counts.items()
+                    ]
+                )
+
+            batch = []
+            for book in books:
+                stale_ids.pop(book.filename, None)
+                batch.append(book)
+                if len(batch) == batch_size:
+                    await store_batch(batch)
+                    stored += len(batch)
+                    batch = []
+            if batch:
+                await store_batch(batch)
+                stored += len(batch)
+
+            await conn.execute(delete_words_query, list(stale_ids.values()))
+            await conn.execute(await load_sql(SQLFiles.UPSERT_INGESTED_ARCHIVE), archive, mtime)
+    return stored
 
 
 async def get_report_data(start_date: datetime, end_date: datetime):
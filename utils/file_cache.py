@@ -0,0 +1,111 @@
+import os
+import json
+import time
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class FileCache:
+    """
+    Size-bounded cache of files in a directory with LRU eviction.
+    The manifest with entry sizes and access times is kept on disk and survives restarts.
+    It is written at most once per save_interval seconds, changes since the last write are lost on a crash,
+    files of entries added since then are dropped as untracked on the next start.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int, save_interval: float = 30.):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+        self.last_save = 0.
+        self.dirty = False
+        self.entries: dict[str, dict] = {}
+        self.load_manifest()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.cache_dir, MANIFEST_FILE)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def load_manifest(self) -> None:
+        """Loads the manifest and drops entries whose files are gone and files that are not tracked."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+
+        self.entries = {
+            name: entry for name, entry in manifest.get("entries", {}).items()
+            if os.path.isfile(self.path(name))
+        }
+
+        # Files without a manifest entry were added after the last manifest write or are interrupted writes
+        for name in os.listdir(self.cache_dir):
+            if name != MANIFEST_FILE and name not in self.entries and os.path.isfile(self.path(name)):
+                os.remove(self.path(name))
+
+        self.evict()
+        self.save_manifest()
+
+    def save_manifest(self) -> None:
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({"entries": self.entries}, file)
+        os.replace(temp_path, self.manifest_path)
+        self.last_save = time.monotonic()
+        self.dirty = False
+
+    def changed(self) -> None:
+        """Marks the manifest as changed, writing it if the last write was long enough ago."""
+        self.dirty = True
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save_manifest()
+
+    def flush(self) -> None:
+        if self.dirty:
+            self.save_manifest()
+
+    def get(self, name: str) -> str | None:
+        """Returns the path of a cached file and records the access, or None on a cache miss."""
+        entry = self.entries.get(name)
+        if entry is None or not os.path.isfile(self.path(name)):
+            if self.entries.pop(name, None) is not None:
+                self.changed()
+            return None
+
+        entry["last_access"] = time.time()
+        self.changed()
+        return self.path(name)
+
+    def add(self, name: str) -> str:
+        """Registers a file that was written to the cache directory and evicts entries over the budget."""
+        self.entries[name] = {
+            "size": os.path.getsize(self.path(name)),
+            "last_access": time.time()
+        }
+        self.evict()
+        self.changed()
+        return self.path(name)
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits the byte budget."""
+        total_bytes = self.total_bytes
+        if total_bytes <= self.max_bytes:
+            return
+
+        for name, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_access"]):
+            if total_bytes <= self.max_bytes:
+                break
+            if os.path.isfile(self.path(name)):
+                os.remove(self.path(name))
+            del self.entries[name]
+            total_bytes -= entry["size"]
+            print(f"File {name} evicted from {self.cache_dir}.")
+
@@ -0,0 +1,260 @@
+import os
+import math
+import time
+import random
+import asyncio
+import zipfile
+from typing import Callable, Literal, Iterable, AsyncIterator
+from contextlib import aclosing
+from datetime import timedelta
+from dataclasses import dataclass, field
+
+from utils import library, zip_index
+from utils.config_parser import read_config
+from utils.database import BookSearchResult, BookCandidate, get_book_by_id, get_book_candidates_by_words_frequency, \
+    iter_book_candidates_with_all_words, get_negative_results, add_negative_result, delete_expired_negative_results
+
+# Assumed size of books missing from the archive index
+DEFAULT_BOOK_SIZE = 2 ** 20
+# Fragment max lengths within the same bucket share negative results
+LENGTH_BUCKET_SIZE = 256
+
+
+StopReason = Literal['accepted', 'exhausted', 'time_budget', 'book_budget']
+
+
+@dataclass
+class FullSearchResult:
+    fragment: str = ""
+    words_found: dict[str, int] = field(default_factory=dict)
+    book: BookSearchResult | None = None
+    books_searched: int = 0
+    stop_reason: StopReason = 'exhausted'
+    # Next best non-overlapping fragments of the same book
+    more_fragments: list[tuple[str, dict[str, int]]] = field(default_factory=list)
+
+
+def is_acceptable(words_found: dict[str, int]) -> bool:
+    """A fragment good enough to stop the full search."""
+    return sum(words_found.values()) > 5 and all(x > 0 for x in words_found.values())
+
+
+def pick_best(found_fragments: list[FullSearchResult]) -> FullSearchResult:
+    """Picks the fragment with the most word occurrences among fragments that contain all words."""
+    best = FullSearchResult()
+    m = -1
+    for result in found_fragments:
+        if sum(result.words_found.values()) > m and all(x > 0 for x in result.words_found.values()):
+            best = result
+            m = sum(result.words_found.values())
+    return best
+
+
+def get_negative_cache_ttl() -> timedelta:
+    search_config = read_config('config.ini').get('Search', {})
+    return timedelta(hours=float(search_config.get('negative_cache_ttl_hours', 168)))
+
+
+def normalize_words(words: list[str]) -> list[str]:
+    """Key of the word set in the negative result cache."""
+    return sorted({word.lower() for word in words})
+
+
+async def clean_negative_cache() -> None:
+    await delete_expired_negative_results(get_negative_cache_ttl())
+
+
+def get_book_size(library_root: str, candidate: BookCandidate) -> int:
+    """Uncompressed size of the book from the catalog, or from the archive index for books without metadata."""
+    if candidate.uncompressed_size is not None:
+        return candidate.uncompressed_size
+    try:
+        member = zip_index.get_member(os.path.join(library_root, candidate.archive), candidate.filename)
+    except (OSError, zipfile.BadZipFile):
+        member = None
+    return member.file_size if member else DEFAULT_BOOK_SIZE
+
+
+def rank_candidates(candidates: list[BookCandidate], words: list[str]) -> list[int]:
+    """
+    Orders candidate books by how likely they are to contain all words close together.
+    Books with more of the words go first, then books where the rarest word occurs more often per megabyte
+    and word frequencies are more balanced. Scores are rounded to buckets, inside a bucket the order is random.
+    Returns ids of the books.
+    """
+    library_root = read_config('config.ini')['Library']['library_root']
+
+    def score(candidate: BookCandidate) -> tuple[int, int, float]:
+        frequencies = [candidate.frequencies.get(word, 0) for word in words]
+        present = [x for x in frequencies if x > 0]
+        if not present:
+            return 0, 0, random.random()
+        size_mb = max(get_book_size(library_root, candidate) / 2 ** 20, 0.05)
+        density = min(present) / size_mb
+        balance = min(present) / max(present)
+        return len(present), round(2 * math.log2(1 + density * balance)), random.random()
+
+    return [candidate.book_id for candidate in sorted(candidates, key=score, reverse=True)]
+
+
+def plan_candidates(candidates: list[BookCandidate], words: list[str]) -> tuple[list[int], list[int]]:
+    """
+    Splits candidate books by their cost before any archive is opened.
+    Books with more than Search.max_book_paragraphs paragraphs or larger than Search.max_book_size_mb
+    are not searched at all, books larger than Search.defer_book_size_mb are searched after the others.
+    Returns ranked ids of books to search first and of deferred books.
+    """
+    search_config = read_config('config.ini').get('Search', {})
+    library_root = read_config('config.ini')['Library']['library_root']
+    max_paragraphs = int(search_config.get('max_book_paragraphs', 150000))
+    max_size = float(search_config.get('max_book_size_mb', 64)) * 2 ** 20
+    defer_size = float(search_config.get('defer_book_size_mb', 8)) * 2 ** 20
+
+    cheap, deferred = [], []
+    skipped = 0
+    for candidate in candidates:
+        size = get_book_size(library_root, candidate)
+        if size > max_size or (candidate.paragraph_count or 0) > max_paragraphs:
+            skipped += 1
+        elif size > defer_size:
+            deferred.append(candidate)
+        else:
+            cheap.append(candidate)
+    if skipped:
+        print(f"Skipped {skipped} books too expensive to search.")
+    return rank_candidates(cheap, words), rank_candidates(deferred, words)
+
+
+async def iter_candidate_book_ids(words: list[str]) -> AsyncIterator[int]:
+    """
+    Yields planned ids of books to search the words in, deferred expensive books last.
+    By default only books containing every word at least Search.min_word_frequency times are fetched,
+    in batches, each batch planned separately. In any_words mode all books where the words occur
+    at least 20 times in total are fetched at once.
+    """
+    search_config = read_config('config.ini').get('Search', {})
+    if search_config.get('candidate_mode', 'all_words') == 'any_words':
+        candidates = await get_book_candidates_by_words_frequency(words, 20)
+        book_ids, deferred_ids = await asyncio.to_thread(plan_candidates, candidates, words)
+        for book_id in book_ids + deferred_ids:
+            yield book_id
+        return
+
+    batches = iter_book_candidates_with_all_words(
+        words,
+        int(search_config.get('min_word_frequency', 3)),
+        int(search_config.get('candidate_batch_size', 50))
+    )
+    deferred_ids = []
+    async with aclosing(batches):
+        async for batch in batches:
+            book_ids, batch_deferred_ids = await asyncio.to_thread(plan_candidates, batch, words)
+            deferred_ids.extend(batch_deferred_ids)
+            for book_id in book_ids:
+                yield book_id
+    for book_id in deferred_ids:
+        yield book_id
+
+
+async def iter_book_ids(book_ids: Iterable[int]) -> AsyncIterator[int]:
+    for book_id in book_ids:
+        yield book_id
+
+
+async def full_search(book_ids: Iterable[int] | AsyncIterator[int], words: list[str], fragment_max_length: Callable[[BookSearchResult], int],
+                      skip_from: int = 0, count: int = 1) -> FullSearchResult:
+    """
+    Searches a fragment in candidate books evaluating several of them concurrently.
+    Stops and cancels outstanding books as soon as an acceptable fragment is found, or when the time
+    or the book budget runs out. Otherwise returns the best fragment found so far.
+    The reason the search stopped is recorded in the result.
+    Books where no fragment with the words was found recently are skipped and do not count towards the budget.
+    Up to count - 1 other fragments of the found book are kept in more_fragments.
+    """
+    search_config = read_config('config.ini').get('Search', {})
+    concurrency = int(search_config.get('full_search_concurrency', 4))
+    time_budget = float(search_config.get('full_search_time_budget', 20))
+    book_budget = int(search_config.get('full_search_book_budget', 200))
+
+    start_time = time.monotonic()
+    candidates = book_ids if isinstance(book_ids, AsyncIterator) else iter_book_ids(book_ids)
+    candidates_lock = asyncio.Lock()
+    found_fragments: list[FullSearchResult] = []
+    accepted: list[FullSearchResult] = []
+    books_searched = books_skipped = 0
+    stop_reason: StopReason = 'exhausted'
+    words_key = normalize_words(words)
+    negative_results = await get_negative_results(words_key, get_negative_cache_ttl())
+
+    async def search_candidates() -> None:
+        nonlocal books_searched, books_skipped, stop_reason
+        while True:
+            # The iterator is shared, so every book is taken by exactly one worker
+            async with candidates_lock:
+                book_id = await anext(candidates, None)
+            if book_id is None:
+                return
+
+            try:
+                book = await get_book_by_id(book_id)
+                max_length = fragment_max_length(book)
+                length_bucket = max_length // LENGTH_BUCKET_SIZE
+                if (book_id, length_bucket) in negative_results:
+                    books_skipped += 1
+                    continue
+                if books_searched >= book_budget:
+                    stop_reason = 'book_budget'
+                    return
+                books_searched += 1
+
+                (fragment, words_found), *more_fragments = await library.process_fragments_search(
+                    book.archive,
+                    book.filename,
+                    words,
+                    max_length=max_length,
+                    skip_from=skip_from,
+                    count=count,
+                    encoding=book.encoding
+                )
+                if not fragment:
+                    # Timed out, skipped and missing books come back without word counts and may succeed next time
+                    if words_found:
+                        await add_negative_result(words_key, length_bucket, book_id)
+                    continue
+                result = FullSearchResult(fragment, words_found, book, more_fragments=more_fragments)
+                if is_acceptable(words_found):
+                    accepted.append(result)
+                    for worker in workers:
+                        if worker is not asyncio.current_task():
+                            worker.cancel()
+                    return
+                found_fragments.append(result)
+            except Exception as error:
+                # A broken book must not take the worker down with it, only cancellation ends a worker
+                print(f"Full search could not search book {book_id}: {error!r}")
+
+    workers = [asyncio.create_task(search_candidates()) for _ in range(max(1, concurrency))]
+    try:
+        _, pending = await asyncio.wait(workers, timeout=time_budget)
+        if pending and not accepted:
+            stop_reason = 'time_budget'
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await candidates.aclose()
+
+    for worker in workers:
+        if not worker.cancelled() and worker.exception() is not None:
+            print(f"Full search worker failed: {worker.exception()!r}")
+
+    if accepted:
+        result = accepted[0]
+        stop_reason = 'accepted'
+    else:
+        result = pick_best(found_fragments)
+    result.books_searched = books_searched
+    result.stop_reason = stop_reason
+    print(f"Full search for {words} stopped ({stop_reason}) after {books_searched} books "
+          f"in {time.monotonic() - start_time:.1f} s, {books_skipped} known dead ends skipped.")
+    return result
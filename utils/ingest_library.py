@@ -0,0 +1,105 @@
+"""
+Builds the catalog of the library: titles, authors and sizes of books in alter_bot_book
+and their word counts in alter_bot_wordscount.
+Archives are ingested in parallel worker processes, archives not changed since their last ingestion are skipped.
+
+Usage: python -m utils.ingest_library [--archive NAME] [--workers N] [--force]
+"""
+import os
+import asyncio
+import argparse
+from typing import Iterator
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import database, library, zip_index
+from utils.config_parser import read_config
+from utils.database import CatalogBook
+
+
+def parse_archive_books(zip_file_name: str) -> Iterator[CatalogBook]:
+    """Parses fb2 files of an archive one by one, counting words the same way the fragment search does."""
+    zip_file_path = library.get_archive_path(zip_file_name)
+    for fb2_file_name in zip_index.get_member_names(zip_file_path):
+        if not fb2_file_name.endswith('.fb2'):
+            continue
+        try:
+            book = library.extract_book_from_zip(zip_file_path, fb2_file_name)
+        except Exception as error:
+            print(f"Could not parse {zip_file_name}/{fb2_file_name}: {error}")
+            continue
+
+        word_counts = Counter()
+        for paragraph in book.paragraphs:
+            word_counts.update(library.tokenize(paragraph))
+        yield CatalogBook(
+            filename=fb2_file_name,
+            title=book.title or os.path.splitext(fb2_file_name)[0],
+            author=book.author,
+            paragraph_count=len(book.paragraphs),
+            uncompressed_size=zip_index.get_member(zip_file_path, fb2_file_name).file_size,
+            word_counts=dict(word_counts),
+            encoding=book.encoding
+        )
+
+
+def ingest_archive(zip_file_name: str, mtime: float, book_ids: dict[str, int]) -> int:
+    """Ingests an archive in a worker process over its own database connection. Returns the number of books stored."""
+    async def run() -> int:
+        await database.init_pool(min_size=1, max_size=1)
+        try:
+            return await database.ingest_archive_books(zip_file_name, mtime, parse_archive_books(zip_file_name), book_ids)
+        finally:
+            await database.pool.close()
+
+    stored = asyncio.run(run())
+    print(f"Ingested {stored} books of {zip_file_name}.")
+    return stored
+
+
+async def plan_ingestion(archives: list[str], force: bool) -> list[tuple[str, float, dict[str, int]]]:
+    """Returns archives to ingest with their mtimes and ids of their books already in the catalog."""
+    await database.init_pool(min_size=1, max_size=1)
+    try:
+        ingested = await database.get_ingested_archives()
+        locations = await database.get_book_locations()
+    finally:
+        await database.pool.close()
+
+    archive_book_ids = {}
+    for (zip_file_name, fb2_file_name), book_id in locations.items():
+        archive_book_ids.setdefault(zip_file_name, {})[fb2_file_name] = book_id
+
+    jobs = []
+    for zip_file_name in archives:
+        mtime = os.path.getmtime(library.get_archive_path(zip_file_name))
+        if force or ingested.get(zip_file_name) != mtime:
+            jobs.append((zip_file_name, mtime, archive_book_ids.get(zip_file_name, {})))
+    return jobs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', action='append', help="Ingest only this archive, may be repeated")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--force', action='store_true', help="Ingest archives even if they have not changed")
+    args = parser.parse_args()
+
+    library_root = read_config('config.ini')['Library']['library_root']
+    archives = args.archive or sorted(name for name in os.listdir(library_root) if name.endswith('.zip'))
+    jobs = asyncio.run(plan_ingestion(archives, args.force))
+    print(f"{len(jobs)} of {len(archives)} archives are new or changed.")
+
+    stored = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(ingest_archive, *job): job[0] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                stored += future.result()
+            except Exception as error:
+                print(f"Could not ingest {futures[future]}: {error!r}")
+    print(f"Ingested {stored} books in {len(jobs)} archives.")
+
+
+if __name__ == "__main__":
+    main()
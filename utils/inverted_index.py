@@ -0,0 +1,150 @@
+import os
+import mmap
+import struct
+from collections import Counter
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INDEX_DIR = os.path.join(PROJECT_ROOT, '.inverted_index')
+
+# File layout after the header, all little-endian:
+#   (P + 1) int64 cumulative paragraph lengths
+#   (W + 1) uint32 offsets of words in the word blob, words sorted by their utf-8 bytes
+#   (W + 1) uint64 offsets of postings in the postings blob
+#   word blob, postings blob
+# Postings of a word are varints: paragraph id delta, occurrence count, repeated.
+INDEX_MAGIC = b'MLII'
+INDEX_VERSION = 1
+HEADER = struct.Struct('<4sHxxdII')
+
+
+def index_path(zip_file_name: str, fb2_file_name: str) -> str:
+    return os.path.join(INDEX_DIR, zip_file_name, fb2_file_name + '.mlii')
+
+
+def encode_varints(values: list[int]) -> bytes:
+    encoded = bytearray()
+    for value in values:
+        while value >= 0x80:
+            encoded.append(value & 0x7f | 0x80)
+            value >>= 7
+        encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Decodes a uint8 array of varints at once."""
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts) if len(data) else np.zeros(0, np.int64)
+
+
+def write_index(path: str, source_mtime: float, paragraphs: list[str], tokenize) -> None:
+    """Writes the index of paragraphs tokenized with the same tokenizer the search uses."""
+    postings: dict[bytes, list[int]] = {}
+    last_paragraph: dict[bytes, int] = {}
+    for paragraph_id, paragraph in enumerate(paragraphs):
+        for token, count in Counter(tokenize(paragraph)).items():
+            word = token.encode('utf-8')
+            postings.setdefault(word, []).extend((paragraph_id - last_paragraph.get(word, 0), count))
+            last_paragraph[word] = paragraph_id
+
+    words = sorted(postings)
+    offsets = np.zeros(len(paragraphs) + 1, dtype='<i8')
+    np.cumsum([len(paragraph) for paragraph in paragraphs], out=offsets[1:])
+    word_offsets = np.zeros(len(words) + 1, dtype='<u4')
+    np.cumsum([len(word) for word in words], out=word_offsets[1:])
+    encoded_postings = [encode_varints(postings[word]) for word in words]
+    postings_offsets = np.zeros(len(words) + 1, dtype='<u8')
+    np.cumsum([len(encoded) for encoded in encoded_postings], out=postings_offsets[1:])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, source_mtime, len(paragraphs), len(words)))
+        file.write(offsets.tobytes())
+        file.write(word_offsets.tobytes())
+        file.write(postings_offsets.tobytes())
+        file.write(b''.join(words))
+        file.write(b''.join(encoded_postings))
+    os.replace(temp_path, path)
+
+
+class BookIndex:
+    """Memory-mapped index of a book. Only the pages of the looked up words and paragraphs are read."""
+    def __init__(self, file, data: mmap.mmap):
+        self.file = file
+        self.data = data
+        _, _, self.source_mtime, paragraph_count, word_count = HEADER.unpack_from(data)
+
+        position = HEADER.size
+        self.offsets = np.frombuffer(data, dtype='<i8', count=paragraph_count + 1, offset=position)
+        position += self.offsets.nbytes
+        self.word_offsets = np.frombuffer(data, dtype='<u4', count=word_count + 1, offset=position)
+        position += self.word_offsets.nbytes
+        self.postings_offsets = np.frombuffer(data, dtype='<u8', count=word_count + 1, offset=position)
+        position += self.postings_offsets.nbytes
+        self.words_start = position
+        self.postings_start = position + int(self.word_offsets[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def word(self, index: int) -> bytes:
+        return self.data[self.words_start + int(self.word_offsets[index]):
+                         self.words_start + int(self.word_offsets[index + 1])]
+
+    def postings(self, word: str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns sorted paragraph ids where the word occurs and occurrence counts, found by binary search."""
+        key = word.encode('utf-8')
+        low, high = 0, len(self.word_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.word(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.word_offsets) - 1 or self.word(low) != key:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+
+        start = self.postings_start + int(self.postings_offsets[low])
+        end = self.postings_start + int(self.postings_offsets[low + 1])
+        values = decode_varints(np.frombuffer(self.data, dtype=np.uint8, count=end - start, offset=start))
+        return np.cumsum(values[0::2]), values[1::2]
+
+    def close(self) -> None:
+        # Arrays over the mapping have to be released before it can be closed
+        del self.offsets, self.word_offsets, self.postings_offsets
+        self.data.close()
+        self.file.close()
+
+
+def load_index(zip_file_name: str, fb2_file_name: str, source_mtime: float) -> BookIndex | None:
+    """Opens the index of the book, or returns None if there is no index built for this version of its archive."""
+    try:
+        file = open(index_path(zip_file_name, fb2_file_name), 'rb')
+    except FileNotFoundError:
+        return None
+
+    try:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        file.close()
+        return None
+    try:
+        magic, version, mtime, _, _ = HEADER.unpack_from(data)
+    except struct.error:
+        magic = version = mtime = None
+    if magic != INDEX_MAGIC or version != INDEX_VERSION or mtime != source_mtime:
+        data.close()
+        file.close()
+        return None
+    return BookIndex(file, data)
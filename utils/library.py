@@ -1,26 +1,56 @@
+import io
 import os
+import codecs
 import re
-import shutil
 import zipfile
 import asyncio
 from pathlib import Path
 
-import aiofiles
+import numpy as np
 import xml.etree.ElementTree as ET
+from xml.parsers import expat
 from datetime import datetime
+from dataclasses import dataclass
+from typing import Iterator, TextIO, Callable, TypeVar, Sequence
+from concurrent.futures.process import BrokenProcessPool
 
 from chardet import UniversalDetector
 
+from utils import corpus, inverted_index, paragraph_store, result_cache, zip_index
 from utils.config_parser import read_config
+from utils.search_pool import run_in_search_pool
 from utils.database import BookSearchResult, get_book_by_url
 
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-CACHE_DIR = os.path.join(PROJECT_ROOT, '.cache')
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
-# Global lock to prevent simultaneous access to file extraction and release
-FILE_LOCK = asyncio.Lock()
+FB2_NAMESPACE = 'http://www.gribuser.ru/xml/fictionbook/2.0'
+FB2_BODY_TAG = f'{{{FB2_NAMESPACE}}}body'
+FB2_PARAGRAPH_TAG = f'{{{FB2_NAMESPACE}}}p'
+FB2_TITLE_INFO_TAG = f'{{{FB2_NAMESPACE}}}title-info'
+FB2_BOOK_TITLE_TAG = f'{{{FB2_NAMESPACE}}}book-title'
+FB2_AUTHOR_TAG = f'{{{FB2_NAMESPACE}}}author'
+FB2_AUTHOR_NAME_TAGS = tuple(f'{{{FB2_NAMESPACE}}}{name}' for name in ('first-name', 'middle-name', 'last-name'))
 
-file_reference_counter = {}
+# Letters matched by a case-insensitive [а-яёa-z] class once lowercased, and the letters they match
+TOKEN_PATTERN = re.compile(r'[а-яёa-zıſᲀ-ᲆ]+')
+SPECIAL_FOLDING = str.maketrans('ıſᲀᲁᲂᲃᲄᲅᲆ', 'isвдосттъ')
+SPECIAL_FOLDING_PATTERN = re.compile(r'[ıſᲀ-ᲆ]')
+
+# Streaming parsers read documents in chunks of this many characters
+PARSER_CHUNK_SIZE = 256 * 1024
+
+T = TypeVar('T')
+
+# Encoding is detected by this many first bytes of a file
+ENCODING_SNIFF_BYTES = 64 * 1024
+XML_DECLARATION_PATTERN = re.compile(rb'\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+
+# Searches in progress by result cache key. A search waits for the same search already running
+# and takes its result from the cache instead of parsing the book in another search worker
+searches_in_flight: dict[str, asyncio.Event] = {}
 
 
 async def yield_zip_file_names(folder_path: str) -> (str, str):
@@ -29,249 +59,652 @@ async def yield_zip_file_names(folder_path: str) -> (str, str):
     for file in folder.iterdir():
         if file.suffix == '.zip' and file.is_file():
             try:
-                with zipfile.ZipFile(file, 'r') as archive:
-                    for name in archive.namelist():
-                        yield file.name, name
+                for name in await asyncio.to_thread(zip_index.get_member_names, str(file)):
+                    yield file.name, name
             except zipfile.BadZipFile:
                 print(f"Error: {file.name} is not a valid ZIP file.")
 
 
-async def async_unzip(zip_file_path: str, fb2_file_name: str, target_path: str) -> None:
+def get_archive_path(zip_file_name: str) -> str:
+    library_dir = read_config('config.ini')['Library']['library_root']
+    return os.path.join(library_dir, zip_file_name)
+
+
+def iter_fb2_paragraphs(source: TextIO) -> Iterator[str]:
     """
-    Extracts a fb2 file from the zip archive asynchronously.
+    Incrementally parses an FB2 document and yields texts of paragraphs inside its bodies.
+    Elements are cleared as soon as they are consumed, so the document is never kept in memory as a whole.
     """
-    def unzip():
-        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-            if fb2_file_name not in zip_ref.namelist():
-                raise FileNotFoundError(f"{fb2_file_name} not found in archive.")
-            with zip_ref.open(fb2_file_name) as source_file, open(target_path, 'wb') as target_file:
-                shutil.copyfileobj(source_file, target_file)
+    body_depth = 0
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if element.tag == FB2_BODY_TAG:
+            body_depth += 1 if event == 'start' else -1
+        if event == 'end':
+            if body_depth and element.tag == FB2_PARAGRAPH_TAG and element.text:
+                yield element.text.strip()
+            element.clear()
+
 
-    await asyncio.to_thread(unzip)
+def read_fb2_paragraphs_etree(source: TextIO) -> list[str]:
+    return list(iter_fb2_paragraphs(source))
 
 
-async def get_fb2_file(zip_file_name: str, fb2_file_name: str) -> str:
+def read_fb2_paragraphs_expat(source: TextIO) -> list[str]:
     """
-    Extracts the specified .fb2 file if not already extracted and increments its reference counter.
-    Returns the path to the .fb2 file.
+    Collects texts of paragraphs inside bodies with expat event handlers, no elements are built at all.
+    Like element.text, only the text before the first child of a paragraph is taken.
     """
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    target_path = os.path.join(CACHE_DIR, fb2_file_name)
+    # Namespaced names come as "namespace}name", etree tags without the leading brace
+    body_tag, paragraph_tag = FB2_BODY_TAG[1:], FB2_PARAGRAPH_TAG[1:]
+    paragraphs = []
+    body_depth = 0
+    # Per open element: parts of the text of a paragraph inside a body, joined once its first child starts,
+    # None for other elements
+    open_texts: list[list[str] | str | None] = []
+
+    def start_element(tag: str, attributes: dict) -> None:
+        nonlocal body_depth
+        if open_texts and isinstance(open_texts[-1], list):
+            open_texts[-1] = "".join(open_texts[-1])
+        if tag == body_tag:
+            body_depth += 1
+        open_texts.append([] if body_depth and tag == paragraph_tag else None)
+
+    def end_element(tag: str) -> None:
+        nonlocal body_depth
+        text = open_texts.pop()
+        if text:
+            paragraphs.append((text if isinstance(text, str) else "".join(text)).strip())
+        if tag == body_tag:
+            body_depth -= 1
+
+    def character_data(data: str) -> None:
+        if open_texts and isinstance(open_texts[-1], list):
+            open_texts[-1].append(data)
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    try:
+        while chunk := source.read(PARSER_CHUNK_SIZE):
+            parser.Parse(chunk, False)
+        parser.Parse("", True)
+    except expat.ExpatError as error:
+        raise ET.ParseError(str(error)) from error
+    return paragraphs
 
-    async with FILE_LOCK:
-        if fb2_file_name in file_reference_counter:
-            file_reference_counter[fb2_file_name] += 1
-            print(
-                f"File {fb2_file_name} is already extracted. Reference count: {file_reference_counter[fb2_file_name]}")
-            return target_path
 
-    library_dir = read_config('config.ini')['Library']['library_root']
-    zip_file_path = os.path.join(library_dir, zip_file_name)
-    if not os.path.isfile(zip_file_path):
-        raise FileNotFoundError(f"The file {zip_file_path} does not exist.")
+def read_fb2_paragraphs_lxml(source: TextIO) -> list[str]:
+    """
+    Collects texts of paragraphs inside bodies with the lxml pull parser, clearing paragraphs once consumed.
+    Only events of bodies and paragraphs reach Python. Comments and processing instructions are dropped
+    like etree does, otherwise text after them would not belong to element.text.
+    """
+    # The text is already decoded, so it is fed as utf-8 whatever the declaration says
+    parser = lxml_etree.XMLPullParser(events=('start', 'end'), tag=(FB2_BODY_TAG, FB2_PARAGRAPH_TAG),
+                                      encoding='utf-8', huge_tree=True, resolve_entities=False,
+                                      remove_comments=True, remove_pis=True)
+    paragraphs = []
+    body_depth = 0
+
+    def consume_events() -> None:
+        nonlocal body_depth
+        for event, element in parser.read_events():
+            if element.tag == FB2_BODY_TAG:
+                body_depth += 1 if event == 'start' else -1
+            if event == 'end':
+                if body_depth and element.tag == FB2_PARAGRAPH_TAG and element.text:
+                    paragraphs.append(element.text.strip())
+                element.clear(keep_tail=True)
+
+    try:
+        while chunk := source.read(PARSER_CHUNK_SIZE):
+            parser.feed(chunk.encode('utf-8'))
+            consume_events()
+        parser.close()
+        consume_events()
+    except lxml_etree.XMLSyntaxError as error:
+        raise ET.ParseError(str(error)) from error
+    return paragraphs
 
-    await async_unzip(zip_file_path, fb2_file_name, target_path)
 
-    async with FILE_LOCK:
-        file_reference_counter[fb2_file_name] = 1
-        print(f"Extracted {fb2_file_name} to {CACHE_DIR}. Reference count: 1")
+PARAGRAPH_PARSERS: dict[str, Callable[[TextIO], list[str]]] = {
+    'etree': read_fb2_paragraphs_etree,
+    'expat': read_fb2_paragraphs_expat,
+    'lxml': read_fb2_paragraphs_lxml,
+}
 
-    return target_path
+paragraph_parser: Callable[[TextIO], list[str]] | None = None
 
 
-async def release_fb2_file(fb2_file_name: str) -> None:
+def get_paragraph_parser() -> Callable[[TextIO], list[str]]:
+    """
+    Returns the paragraph parser chosen by Library.xml_parser: etree (default), expat or lxml.
+    Falls back to etree if lxml is chosen but not installed.
     """
-    Decrements the reference counter for the specified .fb2 file.
-    Deletes the file if the reference count reaches zero.
+    global paragraph_parser
+    if paragraph_parser is None:
+        name = read_config('config.ini')['Library'].get('xml_parser', 'etree')
+        if name not in PARAGRAPH_PARSERS:
+            print(f"Unknown xml parser {name}, using etree.")
+            name = 'etree'
+        elif name == 'lxml' and lxml_etree is None:
+            print("lxml is not installed, using etree.")
+            name = 'etree'
+        paragraph_parser = PARAGRAPH_PARSERS[name]
+    return paragraph_parser
+
+
+@dataclass
+class FB2Book:
+    title: str
+    author: str
+    paragraphs: list[str]
+    encoding: str | None = None
+
+
+def parse_fb2_book(source: TextIO) -> FB2Book:
     """
-    async with FILE_LOCK:
-        if fb2_file_name not in file_reference_counter:
-            print(f"File {fb2_file_name} is not being tracked.")
-            return
+    Incrementally parses an FB2 document into its title, authors and paragraphs inside its bodies.
+    Authors are joined by commas, every author as first, middle and last name.
+    """
+    title = ""
+    authors = []
+    author_names = {}
+    paragraphs = []
+    body_depth = 0
+    in_title_info = False
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if element.tag == FB2_BODY_TAG:
+            body_depth += 1 if event == 'start' else -1
+        elif element.tag == FB2_TITLE_INFO_TAG:
+            in_title_info = event == 'start'
+        if event != 'end':
+            continue
+
+        if body_depth:
+            if element.tag == FB2_PARAGRAPH_TAG and element.text:
+                paragraphs.append(element.text.strip())
+        elif in_title_info:
+            if element.tag == FB2_BOOK_TITLE_TAG and element.text:
+                title = element.text.strip()
+            elif element.tag in FB2_AUTHOR_NAME_TAGS and element.text:
+                author_names[element.tag] = element.text.strip()
+            elif element.tag == FB2_AUTHOR_TAG:
+                authors.append(" ".join(author_names[tag] for tag in FB2_AUTHOR_NAME_TAGS if tag in author_names))
+                author_names = {}
+        element.clear()
+    return FB2Book(title, ", ".join(author for author in authors if author), paragraphs)
+
+
+def read_fb2_paragraphs(source: TextIO) -> list[str]:
+    return get_paragraph_parser()(source)
+
+
+def parse_zip_member(zip_file_path: str, member: zip_index.ZipMember, encoding: str,
+                     parse: Callable[[TextIO], T] = read_fb2_paragraphs) -> T:
+    """
+    Parses an archive member decoding it on the fly.
+    Raises UnicodeDecodeError if the member is not valid in the encoding, even if it is malformed XML as well.
+    """
+    with zip_index.open_member(zip_file_path, member) as source:
+        text = io.TextIOWrapper(source, encoding=encoding)
+        try:
+            return parse(text)
+        except ET.ParseError:
+            # Decode the rest, so a wrong encoding is reported before the parse error
+            while text.read(1024 * 1024):
+                pass
+            raise
+
+
+def is_utf8_text(prefix: bytes) -> bool:
+    """Checks that the first bytes of a document are valid utf-8 with letters beyond ascii."""
+    try:
+        prefix.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # The prefix may end in the middle of a character
+        if error.reason != 'unexpected end of data':
+            return False
+    return not prefix.isascii()
 
-        file_reference_counter[fb2_file_name] -= 1
-        print(
-            f"Decremented reference count for {fb2_file_name}. Reference count: {file_reference_counter[fb2_file_name]}")
 
-        if file_reference_counter[fb2_file_name] == 0:
-            del file_reference_counter[fb2_file_name]
-            target_path = os.path.join(CACHE_DIR, fb2_file_name)
+def sniff_encoding(prefix: bytes) -> str | None:
+    """
+    Returns the encoding given by a byte order mark or the XML declaration at the start of a document.
+    Single-byte encodings decode any bytes, so declarations of utf-8 documents that are wrong are overridden.
+    """
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if prefix.startswith(bom):
+            return encoding
+    if is_utf8_text(prefix):
+        return 'utf-8'
+    match = XML_DECLARATION_PATTERN.match(prefix)
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1).decode('ascii')).name
+    except LookupError:
+        return None
 
-            if os.path.isfile(target_path):
-                os.remove(target_path)
-                print(f"File {fb2_file_name} deleted from {CACHE_DIR}.")
-            else:
-                print(f"File {fb2_file_name} not found in {CACHE_DIR}.")
 
+def detect_encoding(prefix: bytes) -> str | None:
+    """Detects the encoding of a document by its first bytes."""
+    detector = UniversalDetector()
+    for line in io.BytesIO(prefix):
+        detector.feed(line)
+        if detector.done: break
+    detector.close()
+    return detector.result['encoding']
 
-def remove_cache():
-    if os.path.exists(CACHE_DIR) and os.path.isdir(CACHE_DIR):
-        shutil.rmtree(CACHE_DIR)
-        print(f"{CACHE_DIR} and its contents have been deleted.")
-    else:
-        print(f"{CACHE_DIR} does not exist.")
 
+def read_member_prefix(zip_file_path: str, member: zip_index.ZipMember) -> bytes:
+    with zip_index.open_member(zip_file_path, member) as source:
+        return source.read(ENCODING_SNIFF_BYTES)
 
-async def extract_paragraphs_from_fb2(file_path):
-    """Asynchronously extract paragraphs from an FB2 file."""
-    try:
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as file:
-            content = await file.read()
-    except UnicodeDecodeError:
-        print(f"{file_path} could not be read with utf-8. Encoding auto detection...")
-        detector = UniversalDetector()
-        for line in open(file_path, 'rb'):
-            detector.feed(line)
-            if detector.done: break
-        detector.close()
-        print(f"Auto-detected encoding for {file_path}: {detector.result['encoding']}")
-        async with aiofiles.open(file_path, 'r', encoding=detector.result['encoding']) as file:
-            content = await file.read()
 
-    try:
-        tree = ET.ElementTree(ET.fromstring(content))
-    except ET.ParseError:
-        print(f"{file_path} could not be parsed.")
-        return list()
-    root = tree.getroot()
+def iter_encodings(zip_file_path: str, member: zip_index.ZipMember, encoding: str | None) -> Iterator[str | None]:
+    """
+    Yields encodings to decode a fb2 file with: the one known from the catalog, the declared one or utf-8,
+    and the one detected by the first bytes of the file. The file is only sniffed if the known encoding fails.
+    """
+    if encoding:
+        yield encoding
+    prefix = read_member_prefix(zip_file_path, member)
+    yield sniff_encoding(prefix) or 'utf-8'
+    print(f"{member.name} could not be read with the declared encoding. Encoding auto detection...")
+    detected = detect_encoding(prefix)
+    print(f"Auto-detected encoding for {member.name}: {detected}")
+    yield detected
+
+
+def parse_fb2_from_zip(zip_file_path: str, fb2_file_name: str, parse: Callable[[TextIO], T],
+                       default: Callable[[], T], encoding: str | None = None) -> tuple[T, str | None]:
+    """
+    Parses a fb2 file streaming it straight from the zip archive.
+    Returns the result and the encoding it was decoded with, or default() and None if the file could not be parsed.
+    """
+    member = zip_index.get_member(zip_file_path, fb2_file_name)
+    if member is None:
+        raise FileNotFoundError(f"{fb2_file_name} not found in archive.")
+
+    tried = set()
+    for candidate in iter_encodings(zip_file_path, member, encoding):
+        if not candidate or candidate in tried:
+            continue
+        tried.add(candidate)
+        try:
+            return parse_zip_member(zip_file_path, member, candidate, parse), candidate
+        except (UnicodeDecodeError, LookupError):
+            pass
+        except ET.ParseError:
+            break
+    print(f"{fb2_file_name} could not be parsed.")
+    return default(), None
+
+
+def extract_paragraphs_from_zip(zip_file_path: str, fb2_file_name: str, encoding: str | None = None) -> list[str]:
+    """Extracts paragraphs of a fb2 file streaming it straight from the zip archive."""
+    return parse_fb2_from_zip(zip_file_path, fb2_file_name, read_fb2_paragraphs, list, encoding)[0]
+
+
+def extract_book_from_zip(zip_file_path: str, fb2_file_name: str) -> FB2Book:
+    """
+    Extracts the title, authors and paragraphs of a fb2 file streaming it straight from the zip archive,
+    and the encoding of the file.
+    """
+    book, encoding = parse_fb2_from_zip(zip_file_path, fb2_file_name, parse_fb2_book, lambda: FB2Book("", "", []))
+    book.encoding = encoding
+    return book
 
-    namespaces = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
-    paragraphs = root.findall('.//fb:body//fb:p', namespaces)
 
-    return [para.text.strip() for para in paragraphs if para.text]
+def tokenize(paragraph: str) -> list[str]:
+    """
+    Splits a paragraph into lowercase runs of letters, the same runs a case-insensitive [а-яёa-z] class matches.
+    A few letters fold to a different letter than str.lower() gives, they are normalized explicitly.
+    """
+    if 'İ' in paragraph:
+        paragraph = paragraph.replace('İ', 'i')
+    lowered = paragraph.lower()
+    tokens = TOKEN_PATTERN.findall(lowered)
+    if SPECIAL_FOLDING_PATTERN.search(lowered):
+        tokens = [token.translate(SPECIAL_FOLDING) for token in tokens]
+    return tokens
 
 
-async def preprocess_paragraph(paragraph, word_patterns):
-    """Preprocess a single paragraph asynchronously by counting occurrences of target words."""
-    counts = {word: len(re.findall(pattern, paragraph)) for word, pattern in word_patterns.items()}
-    return {"text": paragraph, "length": len(paragraph), "counts": counts}
+def fold_word(word: str) -> str:
+    """Normalizes a query word the same way tokenize() normalizes paragraph tokens."""
+    return word.replace('İ', 'i').lower().translate(SPECIAL_FOLDING)
 
 
-async def preprocess_paragraphs(paragraphs, words):
-    """Preprocess paragraphs asynchronously."""
-    word_patterns = {
-        word: re.compile(rf'(?<![а-яёa-z]){word}(?![а-яёa-z])', re.IGNORECASE | re.MULTILINE)
-        for word in words
-    }
+@dataclass
+class PreprocessedBook:
+    """
+    Paragraphs of a book with occurrences of target words, kept in flat arrays instead of per-paragraph objects.
+    Paragraphs themselves are not copied, stored books are decoded from their mapping only for found fragments.
+    """
+    words: list[str]
+    paragraphs: Sequence[str]
+    offsets: np.ndarray  # (P + 1,) int64 cumulative paragraph lengths
+    counts: np.ndarray  # (P, W) int32, occurrences of words[j] in paragraph i
 
-    chunk_size = 1000
-    chunks = [paragraphs[i:i + chunk_size] for i in range(0, len(paragraphs), chunk_size)]
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
 
-    async def process_chunk(chunk):
-        return [await preprocess_paragraph(p, word_patterns) for p in chunk]
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
 
-    tasks = [process_chunk(chunk) for chunk in chunks]
-    results = await asyncio.gather(*tasks)
+    def paragraph(self, index: int) -> str:
+        return self.paragraphs[index]
 
-    return [item for chunk in results for item in chunk]
 
+def preprocess_paragraph(paragraph, word_keys):
+    """Count occurrences of all target words in a paragraph in one tokenizing pass."""
+    tokens = tokenize(paragraph)
+    return [tokens.count(key) for key in word_keys]
 
-async def quick_feasibility_check(preprocessed, words):
+
+def preprocess_paragraphs(paragraphs, words) -> PreprocessedBook:
+    """Preprocess paragraphs counting occurrences of target words."""
+    words = list(dict.fromkeys(words))
+    word_keys = [fold_word(word) for word in words]
+
+    counts = np.zeros((len(paragraphs), len(words)), dtype=np.int32)
+    offsets = np.zeros(len(paragraphs) + 1, dtype=np.int64)
+    # A single pass, so every stored paragraph is decoded once and dropped right after
+    for i, paragraph in enumerate(paragraphs):
+        row = preprocess_paragraph(paragraph, word_keys)
+        if any(row):
+            counts[i] = row
+        offsets[i + 1] = len(paragraph)
+    np.cumsum(offsets, out=offsets)
+    return PreprocessedBook(words, paragraphs, offsets, counts)
+
+
+def quick_feasibility_check(preprocessed: PreprocessedBook, words):
     """
     Quickly check if it's possible to find a fragment containing all words.
     Returns False if definitely impossible, True if might be possible.
     """
-    # Create a set of words that appear at least once
-    found_words = set()
-    for para in preprocessed:
-        for word, count in para["counts"].items():
-            if count > 0:
-                found_words.add(word)
-        if len(found_words) == len(words):
-            return True
-    return False
+    found_words = np.count_nonzero(preprocessed.counts.any(axis=0))
+    return bool(found_words == len(words))
 
 
-async def find_word_positions(preprocessed, words):
+def find_word_positions(preprocessed: PreprocessedBook, words):
     """
     Create an index of positions where each word appears.
-    Returns a dict of {word: [positions]} where positions are paragraph indices.
+    Returns a dict of {word: positions} where positions are sorted paragraph indices.
     """
-    word_positions = {word: [] for word in words}
-    for i, para in enumerate(preprocessed):
-        for word in words:
-            if para["counts"][word] > 0:
-                word_positions[word].append(i)
-    return word_positions
-
+    return {word: np.flatnonzero(preprocessed.counts[:, j]) for j, word in enumerate(preprocessed.words)}
 
-async def find_best_fragment(preprocessed, words, min_length=512, max_length=2096):
-    """Find the best fragment with the highest balanced presence of all target words."""
-    if not await quick_feasibility_check(preprocessed, words):
-        return "", {word: 0 for word in words}
-
-    # Get word positions
-    word_positions = await find_word_positions(preprocessed, words)
-
-    # Find the minimum window that contains all words
-    all_positions = []
-    for word, positions in word_positions.items():
-        all_positions.extend((pos, word) for pos in positions)
-    all_positions.sort(key=lambda x: x[0])  # Sort by position
-
-    if not all_positions:
-        return "", {word: 0 for word in words}
 
-    best_fragment = []
+def find_best_windows(word_positions: dict[str, np.ndarray], word_occurrences: dict[str, np.ndarray],
+                      offsets: np.ndarray, min_length=512, max_length=2096,
+                      count=1) -> list[tuple[tuple[int, int], list[int]]]:
+    """
+    Slide a window over occurrences of the words looking for the highest balanced presence of all of them.
+    Returns up to count non-overlapping windows as the first and the last paragraph and word counts in the window,
+    best first. Windows with equal scores keep the order they were found in.
+    """
+    # All occurrences ordered by paragraph, occurrences in the same paragraph keep the order of words
+    positions = np.concatenate(list(word_positions.values()))
+    word_indexes = np.repeat(np.arange(len(word_positions)), [len(p) for p in word_positions.values()])
+    order = np.argsort(positions, kind='stable')
+    positions = positions[order].tolist()
+    word_indexes = word_indexes[order].tolist()
+    occurrences = np.concatenate(list(word_occurrences.values()))[order].tolist()
+
+    # Valid windows as (score, start, end, counts), only improvements are kept when a single window is needed
+    windows = []
     best_score = -1
-    best_fragment_count = {word: 0 for word in words}
 
     # Use sliding window approach
     left = 0
-    current_counts = {word: 0 for word in words}
+    current_counts = [0] * len(word_positions)
+    missing_words = len(word_positions)
 
-    for right in range(len(all_positions)):
-        pos, word = all_positions[right]
-        current_counts[word] += preprocessed[pos]["counts"][word]
+    for right in range(len(positions)):
+        word = word_indexes[right]
+        if current_counts[word] == 0:
+            missing_words -= 1
+        current_counts[word] += occurrences[right]
 
         # Try to minimize the window while maintaining all words
         while left < right:
-            left_pos, left_word = all_positions[left]
-            if current_counts[left_word] - preprocessed[left_pos]["counts"][left_word] > 0:
-                current_counts[left_word] -= preprocessed[left_pos]["counts"][left_word]
+            left_word = word_indexes[left]
+            if current_counts[left_word] - occurrences[left] > 0:
+                current_counts[left_word] -= occurrences[left]
                 left += 1
             else:
                 break
 
         # Check if we have a valid window
-        if all(count > 0 for count in current_counts.values()):
-            # Calculate fragment length
-            start_pos = all_positions[left][0]
-            end_pos = pos
-            length = sum(para["length"] for para in preprocessed[start_pos:end_pos + 1])
+        if missing_words == 0:
+            start_pos = positions[left]
+            end_pos = positions[right]
+            length = offsets[end_pos + 1] - offsets[start_pos]
 
             if min_length <= length <= max_length:
-                score = min(current_counts.values())
-                if score > best_score:
-                    best_score = score
-                    best_fragment = preprocessed[start_pos:end_pos + 1]
-                    best_fragment_count = current_counts.copy()
+                score = min(current_counts)
+                if count > 1 or score > best_score:
+                    best_score = max(best_score, score)
+                    windows.append((score, start_pos, end_pos, current_counts.copy()))
+
+    windows.sort(key=lambda window: -window[0])
+    best_windows = []
+    for _, start_pos, end_pos, counts in windows:
+        if len(best_windows) == count:
+            break
+        if all(end_pos < start or start_pos > end for (start, end), _ in best_windows):
+            best_windows.append(((start_pos, end_pos), counts))
+    return best_windows
+
+
+def find_best_fragments(preprocessed: PreprocessedBook, words, min_length=512, max_length=2096, count=1):
+    """Find up to count non-overlapping fragments with the highest balanced presence of all target words."""
+    if not quick_feasibility_check(preprocessed, words):
+        return []
+
+    word_positions = find_word_positions(preprocessed, words)
+    word_occurrences = {
+        word: preprocessed.counts[positions, j] for j, (word, positions) in enumerate(word_positions.items())
+    }
+    windows = find_best_windows(word_positions, word_occurrences, preprocessed.offsets, min_length, max_length, count)
+    return [
+        (
+            "\n\n".join(preprocessed.paragraph(i) for i in range(start_pos, end_pos + 1)),
+            dict(zip(word_positions, counts))
+        )
+        for (start_pos, end_pos), counts in windows
+    ]
 
-    if not best_fragment:
+
+def find_best_fragment(preprocessed: PreprocessedBook, words, min_length=512, max_length=2096):
+    """Find the best fragment with the highest balanced presence of all target words."""
+    fragments = find_best_fragments(preprocessed, words, min_length, max_length)
+    if not fragments:
         return "", {word: 0 for word in words}
+    return fragments[0]
 
-    return "\n\n".join(p["text"] for p in best_fragment), best_fragment_count
 
+def find_best_windows_in_index(index: inverted_index.BookIndex, words, min_length=512, max_length=2096, count=1):
+    """
+    The same search as find_best_fragments over postings of the words in the book index.
+    Returns windows and word counts, the fragment text is read separately.
+    """
+    unique_words = list(dict.fromkeys(words))
+    postings = {word: index.postings(fold_word(word)) for word in unique_words}
+    if sum(1 for positions, _ in postings.values() if len(positions)) != len(words):
+        return []
 
+    windows = find_best_windows(
+        {word: positions for word, (positions, _) in postings.items()},
+        {word: occurrences for word, (_, occurrences) in postings.items()},
+        index.offsets, min_length, max_length, count
+    )
+    return [(window, dict(zip(unique_words, counts))) for window, counts in windows]
 
-async def process_fragment_search(zip_file_name: str, fb2_file_name: str, words: list, max_length: int = 2096, skip_from: int = 0) -> tuple[str, dict[str, int]]:
-    start_time = datetime.now()
+
+def get_book_paragraphs(zip_file_name: str, fb2_file_name: str, encoding: str | None = None) -> Sequence[str]:
+    """
+    Returns paragraphs of the book mapped from the paragraph store, or from the repacked corpus.
+    The book is parsed straight from its archive only if it is in neither of them for the current archive version.
+    """
+    zip_file_path = get_archive_path(zip_file_name)
+    if not os.path.isfile(zip_file_path):
+        raise FileNotFoundError(f"The file {zip_file_path} does not exist.")
+    source_mtime = os.path.getmtime(zip_file_path)
+
+    paragraphs = paragraph_store.open_paragraphs(zip_file_name, fb2_file_name, source_mtime)
+    if paragraphs is not None:
+        return paragraphs
+    paragraphs = corpus.load_paragraphs(zip_file_name, fb2_file_name, source_mtime)
+    if paragraphs is not None:
+        return paragraphs
+
+    paragraphs = extract_paragraphs_from_zip(zip_file_path, fb2_file_name, encoding)
+    paragraph_store.save_paragraphs(zip_file_name, fb2_file_name, source_mtime, paragraphs)
+    print(f"Stored {len(paragraphs)} paragraphs of {fb2_file_name}.")
+    return paragraphs
+
+
+def search_book_fragments(zip_file_name: str, fb2_file_name: str, words: list, max_length: int = 2096,
+                          skip_from: int = 0, count: int = 1,
+                          encoding: str | None = None) -> list[tuple[str, dict[str, int]]]:
+    """
+    Parse, preprocess and window search pipeline of a single book. Runs in a search worker process.
+    Returns up to count non-overlapping fragments with word counts, best first.
+    If there are none, returns a single empty fragment with word counts of the search, or with no counts
+    if the book was not searched.
+    """
+    zip_file_path = get_archive_path(zip_file_name)
+    if not os.path.isfile(zip_file_path):
+        return [("", {})]
+    source_mtime = os.path.getmtime(zip_file_path)
+
+    # Books with a prebuilt index only need postings of the words and the paragraphs of the found windows
+    index = inverted_index.load_index(zip_file_name, fb2_file_name, source_mtime)
+    if index is not None:
+        with index:
+            if skip_from > 0 and len(index) > skip_from:
+                print("Skip book with too many paragraphs.")
+                return [("", {})]
+            if not len(index):
+                return [("", {})]
+            windows = find_best_windows_in_index(index, words, max_length=max_length, count=count)
+        if not windows:
+            return [("", {word: 0 for word in words})]
+
+        fragments = []
+        for (start_pos, end_pos), words_found in windows:
+            paragraphs = paragraph_store.load_paragraph_range(
+                zip_file_name, fb2_file_name, source_mtime, start_pos, end_pos + 1
+            )
+            if paragraphs is None:
+                paragraphs = corpus.load_paragraph_range(
+                    zip_file_name, fb2_file_name, source_mtime, start_pos, end_pos + 1
+                )
+            if paragraphs is None:
+                paragraphs = get_book_paragraphs(zip_file_name, fb2_file_name, encoding)[start_pos:end_pos + 1]
+            fragments.append(("\n\n".join(paragraphs), words_found))
+        return fragments
 
     try:
-        text_file = await get_fb2_file(zip_file_name, fb2_file_name)
+        paragraphs = get_book_paragraphs(zip_file_name, fb2_file_name, encoding)
     except FileNotFoundError:
-        return "", {}
-    else:
-        paragraphs = await extract_paragraphs_from_fb2(text_file)
-        if skip_from > 0 and len(paragraphs) > skip_from:
-            print("Skip book with too many paragraphs.")
-            await release_fb2_file(fb2_file_name)
-            return "", {}
-        if not paragraphs:
-            return "", {}
-        preprocessed = await preprocess_paragraphs(paragraphs, words)
-        fragment, words_found = await find_best_fragment(preprocessed, words, max_length=max_length)
-        await release_fb2_file(fb2_file_name)
-
-        print('Fragment search processed in {}'.format(datetime.now() - start_time))
-        return fragment, words_found
+        return [("", {})]
+
+    if skip_from > 0 and len(paragraphs) > skip_from:
+        print("Skip book with too many paragraphs.")
+        return [("", {})]
+    if not paragraphs:
+        return [("", {})]
+    preprocessed = preprocess_paragraphs(paragraphs, words)
+    return find_best_fragments(preprocessed, words, max_length=max_length, count=count) or \
+        [("", {word: 0 for word in words})]
+
+
+def prefetch_book(zip_file_name: str, fb2_file_name: str, max_bytes: int, encoding: str | None = None) -> int:
+    """
+    Parses the book into the paragraph store ahead of a search. Runs in a search worker process.
+    Books with a prebuilt index, books in the repacked corpus and books larger than max_bytes uncompressed
+    are left alone.
+    Returns the number of paragraphs prefetched.
+    """
+    zip_file_path = get_archive_path(zip_file_name)
+    if not os.path.isfile(zip_file_path):
+        return 0
+    source_mtime = os.path.getmtime(zip_file_path)
+
+    index = inverted_index.load_index(zip_file_name, fb2_file_name, source_mtime)
+    if index is not None:
+        index.close()
+        return 0
+    if corpus.has_book(zip_file_name, fb2_file_name, source_mtime):
+        return 0
+    member = zip_index.get_member(zip_file_path, fb2_file_name)
+    if member is None or member.file_size > max_bytes:
+        return 0
+    return len(get_book_paragraphs(zip_file_name, fb2_file_name, encoding))
+
+
+async def process_fragments_search(zip_file_name: str, fb2_file_name: str, words: list, max_length: int = 2096,
+                                   skip_from: int = 0, count: int = 1,
+                                   encoding: str | None = None) -> list[tuple[str, dict[str, int]]]:
+    """
+    Runs search_book_fragments in the search pool. A search that timed out returns a single empty fragment.
+    While the same search is running, waits for it and returns its cached result.
+    """
+    start_time = datetime.now()
+
+    # Results are cached until the archive changes
+    cache_key = result_cache.fragment_key(zip_file_name, fb2_file_name, words, max_length, skip_from, count)
+    try:
+        source_mtime = os.path.getmtime(get_archive_path(zip_file_name))
+    except OSError:
+        source_mtime = None
+    if source_mtime is not None:
+        cached = await result_cache.get_fragments(cache_key, source_mtime)
+        if cached is not None:
+            print(f"Fragment search result for {fb2_file_name} taken from cache.")
+            return cached
+
+    while (in_flight := searches_in_flight.get(cache_key)) is not None:
+        print(f"The same search in {fb2_file_name} is running, waiting.")
+        await in_flight.wait()
+        # A search that failed caches nothing, then the first of the waiting ones runs it again
+        if source_mtime is not None:
+            cached = await result_cache.get_fragments(cache_key, source_mtime)
+            if cached is not None:
+                return cached
+    in_flight = searches_in_flight[cache_key] = asyncio.Event()
+
+    try:
+        try:
+            fragments = await run_in_search_pool(
+                search_book_fragments, zip_file_name, fb2_file_name, words, max_length, skip_from, count, encoding
+            )
+        except asyncio.TimeoutError:
+            print(f"Fragment search in {fb2_file_name} timed out.")
+            return [("", {})]
+        except BrokenProcessPool:
+            print(f"Search worker died while searching {fb2_file_name}.")
+            return [("", {})]
+
+        # Timed out, skipped and missing books come back without word counts
+        if source_mtime is not None and fragments[0][1]:
+            await result_cache.put_fragments(cache_key, source_mtime, fragments)
+    finally:
+        # Waiting searches are released once the result is cached
+        if searches_in_flight.get(cache_key) is in_flight:
+            del searches_in_flight[cache_key]
+            in_flight.set()
+    print('Fragment search processed in {}'.format(datetime.now() - start_time))
+    return fragments
+
+
+async def process_fragment_search(zip_file_name: str, fb2_file_name: str, words: list, max_length: int = 2096, skip_from: int = 0) -> tuple[str, dict[str, int]]:
+    return (await process_fragments_search(zip_file_name, fb2_file_name, words, max_length, skip_from))[0]
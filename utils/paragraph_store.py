@@ -0,0 +1,177 @@
+import os
+import mmap
+import struct
+from array import array
+from typing import Iterator, Sequence
+
+import numpy as np
+
+from utils.config_parser import read_config
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STORE_DIR = os.path.join(PROJECT_ROOT, '.paragraph_cache')
+
+# File layout: header, (count + 1) native uint64 byte offsets, utf-8 text blob.
+# Paragraph i is blob[offsets[i]:offsets[i + 1]].
+STORE_MAGIC = b'MLPS'
+STORE_VERSION = 1
+HEADER = struct.Struct('<4sHdI')
+
+# The store is shared by all search worker processes, so recency is kept in file mtimes rather than in
+# a per-process manifest: reading a book touches its file, eviction removes the least recently touched files.
+# Every process sweeps the store on its first write and after writing a twentieth of the budget since the last sweep.
+SWEEP_FRACTION = 20
+# A sweep evicts down to this share of the budget, so the next writes do not sweep again right away
+EVICTION_TARGET = 0.9
+
+max_store_bytes: int | None = None
+bytes_since_sweep: int | None = None
+
+
+def store_path(zip_file_name: str, fb2_file_name: str) -> str:
+    """Returns the path of the stored paragraph list for a book."""
+    return os.path.join(STORE_DIR, zip_file_name, fb2_file_name + '.mlps')
+
+
+class StoredParagraphs(Sequence[str]):
+    """
+    Read-only paragraphs of a stored book over a memory mapping of its file.
+    Nothing is decoded up front, a paragraph is decoded straight from the mapping when it is accessed,
+    so processes reading the same book share its pages in the OS page cache instead of copies in their heaps.
+    """
+    def __init__(self, data: mmap.mmap, count: int):
+        self.data = data
+        self.offsets = np.frombuffer(data, dtype=np.uint64, count=count + 1, offset=HEADER.size)
+        self.blob = memoryview(data)[HEADER.size + self.offsets.nbytes:]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("paragraph index out of range")
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        blob = self.blob
+        offsets = self.offsets.tolist()
+        for i in range(len(offsets) - 1):
+            yield str(blob[offsets[i]:offsets[i + 1]], 'utf-8')
+
+
+def open_paragraphs(zip_file_name: str, fb2_file_name: str, source_mtime: float) -> StoredParagraphs | None:
+    """
+    Maps stored paragraphs of the book.
+    Returns None if the book is not stored yet or its archive was modified after it was stored.
+    """
+    try:
+        with open(store_path(zip_file_name, fb2_file_name), 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    try:
+        magic, version, mtime, count = HEADER.unpack_from(data)
+    except struct.error:
+        magic = version = mtime = count = None
+    if magic != STORE_MAGIC or version != STORE_VERSION or mtime != source_mtime:
+        data.close()
+        return None
+    touch(store_path(zip_file_name, fb2_file_name))
+    return StoredParagraphs(data, count)
+
+
+def load_paragraph_range(zip_file_name: str, fb2_file_name: str, source_mtime: float,
+                         start: int, stop: int) -> list[str] | None:
+    """
+    Loads paragraphs start..stop - 1 of the book, only their offsets and text are read from the mapping.
+    Returns None if the book is not stored yet or its archive was modified after it was stored.
+    """
+    paragraphs = open_paragraphs(zip_file_name, fb2_file_name, source_mtime)
+    if paragraphs is None or not 0 <= start <= stop <= len(paragraphs):
+        return None
+    return paragraphs[start:stop]
+
+
+def save_paragraphs(zip_file_name: str, fb2_file_name: str, source_mtime: float, paragraphs: list[str]) -> None:
+    """Stores paragraphs of the book, replacing any previously stored version."""
+    path = store_path(zip_file_name, fb2_file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    encoded = [paragraph.encode('utf-8') for paragraph in paragraphs]
+    offsets = array('Q', [0])
+    for paragraph in encoded:
+        offsets.append(offsets[-1] + len(paragraph))
+
+    # Write to a temporary file first so concurrent readers never see a partial store
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, source_mtime, len(encoded)))
+        file.write(offsets.tobytes())
+        for paragraph in encoded:
+            file.write(paragraph)
+    os.replace(temp_path, path)
+    record_write(HEADER.size + len(offsets) * offsets.itemsize + offsets[-1])
+
+
+def touch(path: str) -> None:
+    """Marks a stored book as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def get_max_store_bytes() -> int:
+    global max_store_bytes
+    if max_store_bytes is None:
+        library_config = read_config('config.ini')['Library']
+        max_store_bytes = int(library_config.get('paragraph_store_size_mb', 4096)) * 1024 * 1024
+    return max_store_bytes
+
+
+def record_write(size: int) -> None:
+    """Counts bytes written by this process and sweeps the store when it is due."""
+    global bytes_since_sweep
+    if bytes_since_sweep is not None:
+        bytes_since_sweep += size
+        if bytes_since_sweep < get_max_store_bytes() // SWEEP_FRACTION:
+            return
+    bytes_since_sweep = 0
+    evict()
+
+
+def evict() -> None:
+    """Removes the least recently used stored books until the store fits the budget."""
+    files = []
+    for directory, _, names in os.walk(STORE_DIR):
+        for name in names:
+            if not name.endswith('.mlps'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in files)
+    if total_bytes <= get_max_store_bytes():
+        return
+    target_bytes = get_max_store_bytes() * EVICTION_TARGET
+    evicted = 0
+    # Mapped files stay readable after removal until their readers close them
+    for _, size, path in sorted(files):
+        if total_bytes <= target_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        evicted += 1
+    print(f"Evicted {evicted} books from {STORE_DIR}, {total_bytes // 2 ** 20} MB left.")
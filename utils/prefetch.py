@@ -0,0 +1,54 @@
+import asyncio
+
+from utils import library
+from utils.config_parser import read_config
+from utils.database import BookSearchResult
+from utils.search_pool import run_in_search_pool
+
+# Prefetch of the selected book per chat
+prefetch_tasks: dict[int, asyncio.Task] = {}
+
+
+async def run_prefetch(book: BookSearchResult, max_bytes: int) -> None:
+    try:
+        paragraphs = await run_in_search_pool(
+            library.prefetch_book, book.archive, book.filename, max_bytes, book.encoding
+        )
+    except asyncio.TimeoutError:
+        print(f"Prefetch of {book.filename} timed out.")
+    except Exception as e:
+        print(f"Prefetch of {book.filename} failed: {e!r}")
+    else:
+        if paragraphs:
+            print(f"Prefetched {paragraphs} paragraphs of {book.filename}.")
+
+
+def start_prefetch(chat_id: int, book: BookSearchResult) -> None:
+    """
+    Starts parsing the book selected in the chat in background, so the search finds it ready.
+    Replaces the previous prefetch of the chat. Does nothing if too many prefetches are running already.
+    """
+    cancel_prefetch(chat_id)
+    search_config = read_config('config.ini').get('Search', {})
+    if len(prefetch_tasks) >= int(search_config.get('prefetch_max_inflight', 2)):
+        print(f"Prefetch of {book.filename} skipped, too many prefetches in progress.")
+        return
+
+    max_bytes = int(search_config.get('prefetch_max_mb', 64)) * 1024 * 1024
+    task = asyncio.create_task(run_prefetch(book, max_bytes))
+    prefetch_tasks[chat_id] = task
+    task.add_done_callback(lambda _: prefetch_tasks.pop(chat_id, None) if prefetch_tasks.get(chat_id) is task else None)
+
+
+def cancel_prefetch(chat_id: int) -> None:
+    """Cancels the prefetch of the chat. A book a search worker has already started parsing is still finished."""
+    task = prefetch_tasks.pop(chat_id, None)
+    if task is not None:
+        task.cancel()
+
+
+async def wait_prefetch(chat_id: int) -> None:
+    """Waits for the prefetch of the chat, so the search does not parse the same book again."""
+    task = prefetch_tasks.get(chat_id)
+    if task is not None:
+        await asyncio.wait([task])
@@ -0,0 +1,59 @@
+"""
+Repacks the library into a seekable corpus: per archive, paragraphs of its books in zstd compressed blocks
+with a per-book block index and paragraph offsets, so a paragraph range is read without parsing the book.
+Archives repacked for their current version are skipped. Requires the zstandard package.
+
+Usage: python -m utils.repack_corpus [--archive NAME] [--workers N] [--level N] [--force]
+"""
+import os
+import argparse
+from typing import Iterator
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import corpus, library, zip_index
+from utils.config_parser import read_config
+
+
+def iter_archive_books(zip_file_name: str) -> Iterator[tuple[str, list[str]]]:
+    zip_file_path = library.get_archive_path(zip_file_name)
+    for fb2_file_name in zip_index.get_member_names(zip_file_path):
+        if not fb2_file_name.endswith('.fb2'):
+            continue
+        try:
+            yield fb2_file_name, library.extract_paragraphs_from_zip(zip_file_path, fb2_file_name)
+        except Exception as error:
+            print(f"Could not parse {zip_file_name}/{fb2_file_name}: {error}")
+
+
+def repack_archive(zip_file_name: str, level: int, force: bool) -> int:
+    """Repacks an archive unless its corpus is up to date. Returns the number of books repacked."""
+    source_mtime = os.path.getmtime(library.get_archive_path(zip_file_name))
+    if not force and corpus.open_corpus(zip_file_name, source_mtime) is not None:
+        return 0
+    repacked = corpus.write_corpus(
+        corpus.corpus_path(zip_file_name), source_mtime, iter_archive_books(zip_file_name), level
+    )
+    print(f"Repacked {repacked} books of {zip_file_name}.")
+    return repacked
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', action='append', help="Repack only this archive, may be repeated")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--level', type=int, default=10, help="zstd compression level")
+    parser.add_argument('--force', action='store_true', help="Repack archives even if they have not changed")
+    args = parser.parse_args()
+    if corpus.zstandard is None:
+        parser.error("the zstandard package is not installed")
+
+    library_root = read_config('config.ini')['Library']['library_root']
+    archives = args.archive or sorted(name for name in os.listdir(library_root) if name.endswith('.zip'))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        repacked = sum(executor.map(partial(repack_archive, level=args.level, force=args.force), archives))
+    print(f"Repacked {repacked} books in {len(archives)} archives.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.config_parser import read_config
+from utils.file_cache import FileCache
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RESULT_CACHE_DIR = os.path.join(PROJECT_ROOT, '.result_cache')
+
+# Most recently used entries in memory, all entries on disk within the byte budget
+memory_entries: OrderedDict[str, dict] = OrderedDict()
+memory_size = 1024
+disk_cache: FileCache | None = None
+# The disk tier is used from worker threads, so the event loop never waits on its file I/O
+DISK_LOCK = threading.Lock()
+
+
+def get_disk_cache() -> FileCache:
+    """Returns the disk tier of the cache, creating it on first use."""
+    global disk_cache, memory_size
+    if disk_cache is None:
+        search_config = read_config('config.ini').get('Search', {})
+        memory_size = int(search_config.get('result_cache_entries', 1024))
+        disk_cache = FileCache(
+            RESULT_CACHE_DIR,
+            max_bytes=int(search_config.get('result_cache_size_mb', 64)) * 1024 * 1024
+        )
+    return disk_cache
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def remember(key: str, entry: dict) -> None:
+    memory_entries[key] = entry
+    memory_entries.move_to_end(key)
+    while len(memory_entries) > memory_size:
+        memory_entries.popitem(last=False)
+
+
+def read_entry(key: str) -> dict | None:
+    """Reads an entry from the disk tier. Blocking, runs in a thread."""
+    with DISK_LOCK:
+        path = get_disk_cache().get(key + '.json')
+    if path is None:
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def write_entry(key: str, entry: dict) -> None:
+    """Writes an entry to the disk tier. Blocking, runs in a thread."""
+    name = key + '.json'
+    with DISK_LOCK:
+        cache = get_disk_cache()
+        temp_path = f"{cache.path(name)}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(temp_path, cache.path(name))
+        cache.add(name)
+
+
+async def get_entry(key: str) -> dict | None:
+    entry = memory_entries.get(key)
+    if entry is not None:
+        memory_entries.move_to_end(key)
+        return entry
+
+    entry = await asyncio.to_thread(read_entry, key)
+    if entry is not None:
+        remember(key, entry)
+    return entry
+
+
+async def put_entry(key: str, entry: dict) -> None:
+    remember(key, entry)
+    await asyncio.to_thread(write_entry, key, entry)
+
+
+def flush() -> None:
+    """Writes the pending manifest changes of the disk tier."""
+    with DISK_LOCK:
+        if disk_cache is not None:
+            disk_cache.flush()
+
+
+def fragment_key(zip_file_name: str, fb2_file_name: str, words: list[str], max_length: int, skip_from: int,
+                 count: int) -> str:
+    return make_key('fragment', zip_file_name, fb2_file_name, words, max_length, skip_from, count)
+
+
+async def get_fragments(key: str, source_mtime: float) -> list[tuple[str, dict[str, int]]] | None:
+    """Returns the cached fragment search result, or None if there is none for this version of the archive."""
+    entry = await get_entry(key)
+    if entry is None or entry["source_mtime"] != source_mtime:
+        return None
+    return [(fragment, words_found) for fragment, words_found in entry["fragments"]]
+
+
+async def put_fragments(key: str, source_mtime: float, fragments: list[tuple[str, dict[str, int]]]) -> None:
+    await put_entry(key, {"source_mtime": source_mtime, "fragments": fragments})
+
+
+async def get_translation(fragment: str, words: list[str]) -> str | None:
+    """Returns the cached fragment with translated words. Changed books produce other fragments, so no mtime check."""
+    entry = await get_entry(make_key('translation', fragment, words))
+    return entry["html"] if entry is not None else None
+
+
+async def put_translation(fragment: str, words: list[str], html: str) -> None:
+    await put_entry(make_key('translation', fragment, words), {"html": html})
@@ -0,0 +1,90 @@
+import os
+import sys
+import asyncio
+import functools
+import multiprocessing
+from typing import Callable, Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.config_parser import read_config
+
+executor: ProcessPoolExecutor | None = None
+worker_count = 0
+task_timeout: float = 60.
+
+# Modules of the bot process that must never be loaded in a search worker, the word2vec model
+# of the synonym finder alone takes gigabytes per process
+BOT_ONLY_MODULES = ('utils.synonym_finder', 'handlers.fragment', 'aiogram')
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool for CPU-bound search work, creating it on first use.
+    Workers are started by a fork server rather than forked from the bot process,
+    so they never inherit locks held by its threads at the moment of the fork.
+    """
+    global executor, worker_count, task_timeout
+    if executor is None:
+        search_config = read_config('config.ini').get('Search', {})
+        worker_count = int(search_config.get('workers', 0)) or os.cpu_count()
+        task_timeout = float(search_config.get('task_timeout', 60))
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        executor = ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context(start_method))
+        print(f"Search pool started with {worker_count} workers.")
+    return executor
+
+
+def start_search_pool() -> None:
+    """
+    Starts the pool and its workers at startup, so no search waits for workers to start and import the bot.
+    Workers are only started on submit, hence a trivial task for each of them.
+    """
+    pool = get_executor()
+    pool.submit(get_bot_only_modules).add_done_callback(report_bot_only_modules)
+    for _ in range(worker_count - 1):
+        pool.submit(os.getpid)
+
+
+def get_bot_only_modules() -> list[str]:
+    """Runs in a worker, returns bot-only modules it has loaded."""
+    return [name for name in BOT_ONLY_MODULES if name in sys.modules]
+
+
+def report_bot_only_modules(future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    if future.result():
+        print(f"Warning: search workers load bot-only modules {', '.join(future.result())}, "
+              f"keep them out of the import graph of the main module.")
+
+
+async def run_in_search_pool(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a picklable function in a search worker process without blocking the event loop.
+    Raises asyncio.TimeoutError if the task takes longer than the configured timeout.
+    A task that has already started keeps its worker busy until it finishes, even after the timeout.
+    Raises BrokenProcessPool if a worker died, e.g. killed for running out of memory, during the task
+    or while the pool was idle. The broken pool is replaced with a new one then.
+    """
+    global executor
+    loop = asyncio.get_running_loop()
+    pool = get_executor()
+    try:
+        # A pool broken while idle already refuses the submit itself
+        future = loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+        return await asyncio.wait_for(future, timeout=task_timeout)
+    except BrokenProcessPool:
+        if executor is pool:
+            print("Search pool is broken, restarting it.")
+            executor = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            start_search_pool()
+        raise
+
+
+def shutdown_search_pool() -> None:
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
@@ -0,0 +1,164 @@
+import io
+import os
+import bz2
+import json
+import zlib
+import struct
+import zipfile
+import threading
+from typing import NamedTuple, BinaryIO
+
+from utils.archive_pool import ArchiveHandle, get_archive_pool
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INDEX_DIR = os.path.join(PROJECT_ROOT, '.zip_index_cache')
+INDEX_VERSION = 1
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+# Indexes already loaded by this process, validated by archive mtime and size on every lookup
+loaded_indexes: dict[str, dict] = {}
+INDEX_LOCK = threading.Lock()
+
+
+class ZipMember(NamedTuple):
+    name: str
+    header_offset: int
+    compress_size: int
+    file_size: int
+    compress_type: int
+    crc: int
+
+
+def index_path(zip_file_path: str) -> str:
+    return os.path.join(INDEX_DIR, os.path.basename(zip_file_path) + '.json')
+
+
+def build_index(zip_file_path: str) -> dict:
+    """Reads the central directory of the archive once and stores it as an index on disk."""
+    stat = os.stat(zip_file_path)
+    with zipfile.ZipFile(zip_file_path, 'r') as archive:
+        members = {
+            info.filename: [info.header_offset, info.compress_size, info.file_size, info.compress_type, info.CRC]
+            for info in archive.infolist() if not info.is_dir()
+        }
+    index = {"version": INDEX_VERSION, "mtime": stat.st_mtime, "size": stat.st_size, "members": members}
+
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    temp_path = f"{index_path(zip_file_path)}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(index, file, ensure_ascii=False)
+    os.replace(temp_path, index_path(zip_file_path))
+    print(f"Indexed {len(members)} members of {zip_file_path}.")
+    return index
+
+
+def is_fresh(index: dict | None, stat: os.stat_result) -> bool:
+    return (index is not None and index.get("version") == INDEX_VERSION
+            and index["mtime"] == stat.st_mtime and index["size"] == stat.st_size)
+
+
+def get_index(zip_file_path: str) -> dict:
+    """Returns the central directory index of the archive, loading or rebuilding it if needed."""
+    stat = os.stat(zip_file_path)
+    with INDEX_LOCK:
+        index = loaded_indexes.get(zip_file_path)
+        if is_fresh(index, stat):
+            return index
+
+        try:
+            with open(index_path(zip_file_path), 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = None
+        if not is_fresh(index, stat):
+            index = build_index(zip_file_path)
+
+        loaded_indexes[zip_file_path] = index
+        return index
+
+
+def get_member(zip_file_path: str, member_name: str) -> ZipMember | None:
+    entry = get_index(zip_file_path)["members"].get(member_name)
+    return ZipMember(member_name, *entry) if entry else None
+
+
+def get_member_names(zip_file_path: str) -> list[str]:
+    return list(get_index(zip_file_path)["members"])
+
+
+class MemberReader(io.RawIOBase):
+    """
+    Reads and decompresses a single member, starting right at its data without the central directory.
+    Only stored, deflated and bzip2 members get here, open_member passes others to zipfile.
+    """
+    def __init__(self, handle: ArchiveHandle, member: ZipMember):
+        super().__init__()
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            self.decompressor = zlib.decompressobj(-15)
+        elif member.compress_type == zipfile.ZIP_BZIP2:
+            self.decompressor = bz2.BZ2Decompressor()
+        else:
+            self.decompressor = None
+
+        header = LOCAL_HEADER.unpack(handle.read_at(member.header_offset, LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local file header for {member.name}.")
+        name_length, extra_length = header[-2:]
+
+        self.handle = handle
+        self.member = member
+        self.position = member.header_offset + LOCAL_HEADER.size + name_length + extra_length
+        self.compressed_left = member.compress_size
+        self.buffer = b''
+        self.crc = 0
+        self.eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.buffer and not self.eof:
+            chunk = self.handle.read_at(self.position, min(self.compressed_left, 64 * 1024))
+            self.position += len(chunk)
+            self.compressed_left -= len(chunk)
+            if self.decompressor is None:
+                data = chunk
+            elif chunk:
+                data = self.decompressor.decompress(chunk)
+            elif self.member.compress_type == zipfile.ZIP_DEFLATED:
+                data = self.decompressor.flush()
+            else:
+                data = b''
+            self.crc = zlib.crc32(data, self.crc)
+            self.buffer = data
+
+            if not chunk:
+                self.eof = True
+                if self.crc != self.member.crc:
+                    raise zipfile.BadZipFile(f"Bad CRC-32 for {self.member.name}.")
+
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            get_archive_pool().release(self.handle)
+        super().close()
+
+
+def open_member(zip_file_path: str, member: ZipMember) -> BinaryIO:
+    """Opens a member for reading through a pooled archive handle, seeking straight to its local header."""
+    if member.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2):
+        # Rare compression methods go through zipfile, which keeps the archive open until the member is closed
+        return zipfile.ZipFile(zip_file_path, 'r').open(member.name)
+
+    handle = get_archive_pool().acquire(zip_file_path)
+    try:
+        return io.BufferedReader(MemberReader(handle, member), buffer_size=64 * 1024)
+    except BaseException:
+        get_archive_pool().release(handle)
+        raise